@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""
+Compares the query plans and timings of the old DISTINCT + OR-join access
+filter with the current `for_user` query on a large share table.
+
+    python benchmarks/access_query.py --folders 10000 --users 100
+    python benchmarks/access_query.py --postgres pinax_documents_bench
+
+The default sizes produce 1M FolderSharedUser rows.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import django
+
+from django.conf import settings
+
+
+def configure(args):
+    if args.postgres:
+        database = {"ENGINE": "django.db.backends.postgresql", "NAME": args.postgres}
+    else:
+        database = {"ENGINE": "django.db.backends.sqlite3", "NAME": os.path.join(tempfile.mkdtemp(), "bench.db")}
+    settings.configure(
+        INSTALLED_APPS=[
+            "django.contrib.auth",
+            "django.contrib.contenttypes",
+            "pinax.documents",
+        ],
+        DATABASES={"default": database},
+        SECRET_KEY="notasecret",
+    )
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    django.setup()
+
+
+def populate(args):
+    from django.contrib.auth import get_user_model
+    from django.core.management import call_command
+    from django.db.models.signals import post_save
+
+    from pinax.documents.models import Folder, FolderSharedUser
+    from pinax.documents.receivers import ensure_userstorage
+
+    call_command("migrate", verbosity=0)
+    post_save.disconnect(ensure_userstorage, sender=settings.AUTH_USER_MODEL)
+    User = get_user_model()
+    User.objects.bulk_create(User(username=f"user{i}") for i in range(args.users))
+    users = list(User.objects.values_list("pk", flat=True))
+    owner = users[0]
+    Folder.objects.bulk_create(
+        (Folder(name=f"folder{i}", author_id=owner, modified_by_id=owner) for i in range(args.folders)),
+        batch_size=args.batch_size,
+    )
+    folders = Folder.objects.values_list("pk", flat=True).iterator()
+    rows = (FolderSharedUser(folder_id=f, user_id=u) for f in folders for u in users[1:])
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == args.batch_size:
+            FolderSharedUser.objects.bulk_create(batch)
+            batch = []
+    FolderSharedUser.objects.bulk_create(batch)
+    return User.objects.get(pk=users[-1])
+
+
+def measure(label, qs, repeat):
+    print(f"== {label}")
+    print(qs.explain())
+    start = time.perf_counter()
+    for _ in range(repeat):
+        count = len(list(qs.values_list("pk", flat=True)))
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"{count} rows, {elapsed * 1000:.1f} ms per query\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--folders", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=101)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--postgres", help="name of a PostgreSQL database to run against")
+    args = parser.parse_args()
+    configure(args)
+
+    from django.db.models import Q
+
+    from pinax.documents.models import Folder, FolderSharedUser
+
+    user = populate(args)
+    print(f"{FolderSharedUser.objects.count()} share rows\n")
+    old = Folder.objects.filter(Q(author=user) | Q(foldershareduser__user=user)).distinct()
+    measure("DISTINCT + OR-join", old, args.repeat)
+    measure("for_user", Folder.objects.for_user(user), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+"""
+Load test of the async views (pinax.documents.async_urls) against the sync
+ones (pinax.documents.urls) under Django's ASGI handler on a single worker
+(one event loop in one process). Needs Django 3.1 or later. Concurrent
+clients download documents and list a folder; opening and reading stored
+files and the clients themselves are slowed down to model object storage
+and real networks.
+
+    python benchmarks/async_views.py --clients 50 --requests 4
+    python benchmarks/async_views.py --open-latency 0.1 --read-latency 0.005
+
+Django before 4.2 reads streaming bodies on the event loop for sync and
+async views alike, so the gain comes from the views' own waits.
+
+Requests are fed straight into the ASGI application, so no server is needed.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import django
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+
+
+def configure(args):
+    root = tempfile.mkdtemp()
+    settings.configure(
+        INSTALLED_APPS=[
+            "django.contrib.auth",
+            "django.contrib.contenttypes",
+            "django.contrib.sessions",
+            "pinax.documents",
+        ],
+        DATABASES={"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": os.path.join(root, "bench.db")}},
+        MIDDLEWARE=[
+            "django.contrib.sessions.middleware.SessionMiddleware",
+            "django.contrib.auth.middleware.AuthenticationMiddleware",
+        ],
+        ROOT_URLCONF="pinax.documents.urls",
+        DEFAULT_FILE_STORAGE="__main__.SlowStorage",
+        MEDIA_ROOT=os.path.join(root, "media"),
+        TEMPLATES=[{"BACKEND": "django.template.backends.django.DjangoTemplates", "DIRS": [root]}],
+        SECRET_KEY="notasecret",
+        OPEN_LATENCY=args.open_latency,
+        READ_LATENCY=args.read_latency,
+    )
+    os.makedirs(os.path.join(root, "pinax", "documents"))
+    for name in ["folder_detail.html", "document_detail.html", "index.html"]:
+        with open(os.path.join(root, "pinax", "documents", name), "w") as f:
+            f.write("{% for member in members %}{{ member.name }} {% endfor %}")
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    django.setup()
+
+
+class SlowFile:
+
+    def __init__(self, f):
+        self.f = f
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+    def read(self, *args):
+        time.sleep(settings.READ_LATENCY)
+        return self.f.read(*args)
+
+
+class SlowStorage(FileSystemStorage):
+    """
+    Local files that take a while to open and read, like object storage.
+    """
+
+    def _open(self, name, mode="rb"):
+        time.sleep(settings.OPEN_LATENCY)
+        return SlowFile(super()._open(name, mode))
+
+
+def populate(args):
+    from django.contrib.auth import get_user_model
+    from django.contrib.sessions.backends.db import SessionStore
+    from django.core.files.base import ContentFile
+    from django.core.management import call_command
+
+    from pinax.documents.models import Document, Folder
+
+    call_command("migrate", verbosity=0)
+    user = get_user_model().objects.create_user("bench")
+    folder = Folder.objects.create(name="Folder", author=user)
+    documents = [
+        Document.objects.create(name=f"{i}.bin", folder=folder, author=user, file=ContentFile(b"x" * args.size, name=f"{i}.bin"))
+        for i in range(args.documents)
+    ]
+    session = SessionStore()
+    session["_auth_user_id"] = str(user.pk)
+    session["_auth_user_backend"] = "django.contrib.auth.backends.ModelBackend"
+    session["_auth_user_hash"] = user.get_session_auth_hash()
+    session.create()
+    return folder, documents, session.session_key
+
+
+async def client(application, paths, cookie, latency, timings):
+    for path in paths:
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": path,
+            "query_string": b"",
+            "headers": [(b"cookie", f"{settings.SESSION_COOKIE_NAME}={cookie}".encode())],
+        }
+        status = []
+
+        async def receive():
+            return {"type": "http.request", "body": b""}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                status.append(message["status"])
+            elif latency:
+                await asyncio.sleep(latency)
+
+        start = time.perf_counter()
+        await application(scope, receive, send)
+        timings.append(time.perf_counter() - start)
+        assert status == [200], (path, status)
+
+
+async def load(application, paths, cookie, args):
+    timings = []
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        client(application, paths[i::args.clients], cookie, args.client_latency, timings)
+        for i in range(args.clients)
+    ))
+    return time.perf_counter() - start, sorted(timings)
+
+
+def run(label, application, paths, cookie, args):
+    elapsed, timings = asyncio.run(load(application, paths, cookie, args))
+    print(f"== {label}")
+    print(
+        f"{len(paths)} requests in {elapsed:.2f} s ({len(paths) / elapsed:.1f} req/s), "
+        f"median {timings[len(timings) // 2] * 1000:.0f} ms, p95 {timings[int(len(timings) * 0.95)] * 1000:.0f} ms\n"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=4, help="requests per client")
+    parser.add_argument("--documents", type=int, default=20)
+    parser.add_argument("--size", type=int, default=256 * 1024, help="bytes per document")
+    parser.add_argument("--open-latency", type=float, default=0.05, help="seconds to open a stored file")
+    parser.add_argument("--read-latency", type=float, default=0.0, help="seconds per storage read")
+    parser.add_argument("--client-latency", type=float, default=0.005, help="seconds per body message sent")
+    args = parser.parse_args()
+    configure(args)
+
+    from django.core.asgi import get_asgi_application
+    from django.urls import clear_url_caches, reverse
+
+    folder, documents, cookie = populate(args)
+    urls = [reverse("document_download", args=[document.pk]) for document in documents]
+    urls.append(reverse("folder_detail", args=[folder.pk]))
+    paths = [urls[i % len(urls)] for i in range(args.clients * args.requests)]
+    application = get_asgi_application()
+    run("pinax.documents.urls", application, paths, cookie, args)
+    settings.ROOT_URLCONF = "pinax.documents.async_urls"
+    clear_url_caches()
+    run("pinax.documents.async_urls", application, paths, cookie, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""
+Compares per-descendant share rows with DOCUMENTS_INHERITED_SHARING on a
+shared tree: share table size, the time to share the tree, and the latency
+of listing a folder and checking access to a single document.
+
+    python benchmarks/inherited_sharing.py --depth 4 --fanout 8 --users 50
+    python benchmarks/inherited_sharing.py --postgres pinax_documents_bench
+
+The default sizes produce a tree of 4681 folders and 14043 documents.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import django
+
+from django.conf import settings
+
+
+def configure(args):
+    if args.postgres:
+        database = {"ENGINE": "django.db.backends.postgresql", "NAME": args.postgres}
+    else:
+        database = {"ENGINE": "django.db.backends.sqlite3", "NAME": os.path.join(tempfile.mkdtemp(), "bench.db")}
+    settings.configure(
+        INSTALLED_APPS=[
+            "django.contrib.auth",
+            "django.contrib.contenttypes",
+            "pinax.documents",
+        ],
+        DATABASES={"default": database},
+        DEFAULT_FILE_STORAGE="django.core.files.storage.FileSystemStorage",
+        SECRET_KEY="notasecret",
+    )
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    django.setup()
+
+
+def populate(args):
+    from django.contrib.auth import get_user_model
+    from django.core.management import call_command
+    from django.db.models.signals import post_save
+
+    from pinax.documents.models import Document, Folder
+    from pinax.documents.receivers import ensure_userstorage
+    from pinax.documents.utils import build_folder_paths
+
+    call_command("migrate", verbosity=0)
+    post_save.disconnect(ensure_userstorage, sender=settings.AUTH_USER_MODEL)
+    User = get_user_model()
+    User.objects.bulk_create(User(username=f"user{i}") for i in range(args.users + 1))
+    users = list(User.objects.all())
+    owner = users[0]
+    root = Folder.objects.create(name="root", author=owner, modified_by=owner)
+    level = [root.pk]
+    for depth in range(args.depth):
+        Folder.objects.bulk_create(
+            (
+                Folder(name=f"f{depth}-{i}", parent_id=parent, author=owner, modified_by=owner)
+                for parent in level
+                for i in range(args.fanout)
+            ),
+            batch_size=args.batch_size,
+        )
+        level = list(Folder.objects.filter(name__startswith=f"f{depth}-").values_list("pk", flat=True))
+    build_folder_paths(Folder)
+    Document.objects.bulk_create(
+        (
+            Document(name=f"d{i}", folder_id=folder, author=owner, modified_by=owner, file=f"document/{i}.txt", file_size=1)
+            for folder in Folder.objects.values_list("pk", flat=True).iterator()
+            for i in range(args.documents)
+        ),
+        batch_size=args.batch_size,
+    )
+    return root, users[1:]
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.perf_counter() - start) / repeat * 1000
+
+
+def run(label, root, users, args):
+    from pinax.documents.models import (
+        Document,
+        DocumentSharedUser,
+        Folder,
+        FolderSharedUser,
+    )
+
+    FolderSharedUser.objects.all().delete()
+    DocumentSharedUser.objects.all().delete()
+    _, share_ms = timed(lambda: root.share(users), 1)
+    rows = FolderSharedUser.objects.count() + DocumentSharedUser.objects.count()
+    user = users[-1]
+    leaf = Folder.objects.order_by("-pk").first()
+    document = Document.objects.filter(folder=leaf).first()
+    _, list_ms = timed(lambda: list(Document.objects.for_user(user).filter(folder=leaf)), args.repeat)
+    _, check_ms = timed(lambda: Document.objects.for_user(user).filter(pk=document.pk).exists(), args.repeat)
+    print(f"== {label}")
+    print(f"{rows} share rows, shared in {share_ms:.0f} ms")
+    print(f"list leaf folder: {list_ms:.2f} ms, check one document: {check_ms:.2f} ms\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--fanout", type=int, default=8)
+    parser.add_argument("--documents", type=int, default=3, help="documents per folder")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, help="rows per INSERT (default: chosen by the backend)")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--postgres", help="name of a PostgreSQL database to run against")
+    args = parser.parse_args()
+    configure(args)
+
+    from django.test.utils import override_settings
+
+    root, users = populate(args)
+    with override_settings(DOCUMENTS_INHERITED_SHARING=False):
+        run("per-descendant rows", root, users, args)
+    with override_settings(DOCUMENTS_INHERITED_SHARING=True):
+        run("inherited sharing", root, users, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+from django.conf.urls import url
+
+from . import async_views, urls
+
+app_name = "pinax_documents"
+
+async_patterns = [
+    url(r"^$", async_views.index,
+        name="document_index"),
+    url(r"^d/(?P<pk>\d+)/$", async_views.document_detail,
+        name="document_detail"),
+    url(r"^d/(?P<pk>\d+)/download/$", async_views.document_download,
+        name="document_download"),
+    url(r"^f/(?P<pk>\d+)/$", async_views.folder_detail,
+        name="folder_detail"),
+]
+
+# every other view is served as in pinax.documents.urls
+urlpatterns = async_patterns + [
+    pattern for pattern in urls.urlpatterns
+    if pattern.name not in {p.name for p in async_patterns}
+]
@@ -0,0 +1,61 @@
+"""
+Async variants of the listing, detail and download views, served when a
+project includes `pinax.documents.async_urls` instead of
+`pinax.documents.urls`. They go through the project's middleware like any
+other view. Requires Django 3.1 or later and asgiref 3.5 or later.
+
+Django's ORM is synchronous, so each view runs its sync counterpart in one
+shared pool of DOCUMENTS_ASYNC_THREADS threads rather than the single
+thread Django runs every sync view in. Database connections are bounded
+by the pool size.
+"""
+import functools
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections
+
+from asgiref.sync import sync_to_async
+
+from . import views
+from .conf import settings
+
+if django.VERSION < (3, 1) or "executor" not in inspect.signature(sync_to_async).parameters:
+    raise ImproperlyConfigured("pinax.documents.async_views requires Django 3.1 and asgiref 3.5 or later.")
+
+
+@functools.lru_cache(maxsize=None)
+def get_executor():
+    """
+    Returns the thread pool shared by all async views.
+    """
+    return ThreadPoolExecutor(max_workers=settings.DOCUMENTS_ASYNC_THREADS, thread_name_prefix="pinax-documents")
+
+
+def async_view(view):
+    """
+    Returns an async version of the sync `view` that runs it in the shared
+    pool, rendering template responses before the thread is released.
+    """
+    def run(request, *args, **kwargs):
+        close_old_connections()
+        try:
+            response = view(request, *args, **kwargs)
+            if hasattr(response, "render") and callable(response.render):
+                response.render()
+            return response
+        finally:
+            close_old_connections()
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        return await sync_to_async(run, thread_sensitive=False, executor=get_executor())(request, *args, **kwargs)
+    return wrapper
+
+
+index = async_view(views.IndexView.as_view())
+folder_detail = async_view(views.FolderDetail.as_view())
+document_detail = async_view(views.DocumentDetail.as_view())
+document_download = async_view(views.DocumentDownload.as_view())
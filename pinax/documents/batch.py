@@ -0,0 +1,266 @@
+import collections
+import itertools
+import posixpath
+import zipfile
+
+from django.core.files import File
+from django.db import models, transaction
+from django.db.models import Case, F, Q, Value, When
+
+from .conf import settings
+from .deletion import queue_file_deletions
+from .exceptions import (
+    BatchUploadError,
+    DuplicateDocumentNameError,
+    DuplicateFolderNameError,
+)
+from .models import (
+    Document,
+    DocumentSharedUser,
+    Folder,
+    FolderSharedUser,
+    PendingIndexUpdate,
+    child_path,
+)
+from .uploads import HashingReader
+from .utils import file_checksum, guess_content_type
+
+# `path` is the file's path below the target folder, split into parts;
+# `open` returns the file content as a django File, from the start.
+Entry = collections.namedtuple("Entry", ["path", "size", "content_type", "open"])
+
+
+def split_path(name):
+    parts = [part for part in name.replace("\\", "/").split("/") if part not in ("", ".")]
+    if not parts or ".." in parts:
+        raise BatchUploadError(f"Invalid path: {name}")
+    return tuple(parts)
+
+
+def upload_entries(uploads):
+    """
+    Returns entries for uploaded files, all placed directly in the target folder.
+    """
+    return [
+        Entry(split_path(upload.name), upload.size, upload.content_type, lambda upload=upload: upload.open())
+        for upload in uploads
+    ]
+
+
+def archive_entries(archive):
+    """
+    Returns entries for the files in the zip `archive`. Only the archive's
+    directory is read up front; members are decompressed as they are
+    stored, never buffered whole.
+    """
+    try:
+        zf = zipfile.ZipFile(archive)
+    except zipfile.BadZipFile:
+        raise BatchUploadError("Not a zip archive.")
+
+    def opener(info):
+        f = File(zf.open(info), name=posixpath.basename(info.filename))
+        f.size = info.file_size
+        return f
+
+    return [
+        Entry(split_path(info.filename), info.file_size, None, lambda info=info: opener(info))
+        for info in zf.infolist()
+        if not info.is_dir() and not info.filename.startswith("__MACOSX/")
+    ]
+
+
+def ensure_folders(user, root, paths):
+    """
+    Returns a dict mapping each folder path in `paths` (tuples of names below
+    `root`) to a Folder, reusing existing folders and creating the missing
+    ones level by level with bulk_create. Also returns the created folders.
+    Raises DuplicateFolderNameError if a name is taken by a folder `user`
+    cannot access.
+    """
+    folders, created = {(): root}, []
+    wanted = sorted({path[:i] for path in paths for i in range(1, len(path) + 1)}, key=len)
+    for _, level in itertools.groupby(wanted, len):
+        level = list(level)
+        parents = {folders[path[:-1]] for path in level}
+        query = Q(parent__in=[parent for parent in parents if parent is not None])
+        if None in parents:
+            query |= Q(parent__isnull=True)
+        siblings = Folder.objects.filter(query, name__in={path[-1] for path in level}, trashed__isnull=True)
+
+        def lookup():
+            return {(folder.parent_id, folder.name): folder for folder in siblings.all()}
+
+        existing = lookup()
+        reused = [
+            existing[key].pk
+            for key in ((getattr(folders[path[:-1]], "pk", None), path[-1]) for path in level)
+            if key in existing
+        ]
+        if reused:
+            # folder names are unique per parent across users, so a folder
+            # the user cannot access is a clash rather than a target
+            accessible = Folder.objects.for_user(user).filter(pk__in=reused).values_list("pk", flat=True)
+            hidden = set(reused) - set(accessible)
+            if hidden:
+                clashes = sorted(folder.name for folder in existing.values() if folder.pk in hidden)
+                raise DuplicateFolderNameError(f"{', '.join(clashes)} already exists in this folder.")
+        missing = [
+            Folder(name=path[-1], parent=folders[path[:-1]], author=user, modified_by=user)
+            for path in level
+            if (getattr(folders[path[:-1]], "pk", None), path[-1]) not in existing
+        ]
+        if missing:
+            Folder.objects.bulk_create(missing)
+            existing = lookup()
+        new = []
+        for path in level:
+            parent = folders[path[:-1]]
+            folder = folders[path] = existing[(getattr(parent, "pk", None), path[-1])]
+            if not folder.path:
+                folder.path = child_path(parent.path if parent else "", folder.pk)
+                new.append(folder)
+        Folder.objects.bulk_update(new, ["path"])
+        created.extend(new)
+    return folders, created
+
+
+def check_duplicates(folders, entries):
+    """
+    Raises DuplicateDocumentNameError if any entry would reuse the name of an
+    existing document, checking the whole batch with one query.
+    """
+    wanted = {(getattr(folders[entry.path[:-1]], "pk", None), entry.path[-1]) for entry in entries}
+    query = Q(folder__in=[pk for pk, _ in wanted if pk is not None])
+    if any(pk is None for pk, _ in wanted):
+        query |= Q(folder__isnull=True)
+    existing = Document.objects.filter(query, name__in={name for _, name in wanted}, trashed__isnull=True)
+    clashes = sorted(name for pk, name in existing.values_list("folder", "name") if (pk, name) in wanted)
+    if clashes:
+        raise DuplicateDocumentNameError(f"{', '.join(clashes)} already exists in this folder.")
+
+
+def build_document(user, folder, entry):
+    name = entry.path[-1]
+    document = Document(
+        name=name,
+        original_filename=name,
+        folder=folder,
+        author=user,
+        modified_by=user,
+        file_size=entry.size,
+        content_type=entry.content_type or guess_content_type(name),
+    )
+    # zip members cannot seek before Python 3.7, so the content is read
+    # once while it is stored, or opened again once the digest is known
+    if settings.DOCUMENTS_CONTENT_ADDRESSED_STORAGE:
+        # the blob is named after the digest, which is needed first
+        document.checksum = file_checksum(entry.open(), rewind=False)
+        document.file = Document.store_blob(entry.open(), document.checksum)
+    else:
+        reader = HashingReader(entry.open())
+        content = File(reader, name=name)
+        content.size = entry.size
+        document.file.save(name, content, save=False)
+        document.checksum = reader.hexdigest()
+    return document
+
+
+def batch_deltas(folders, documents):
+    """
+    Returns the (bytes, documents, folders) added to each affected folder,
+    keyed by folder id.
+    """
+    deltas = collections.defaultdict(lambda: [0, 0, 0])
+    for document in documents:
+        if document.folder_id:
+            for pk in document.folder.ancestor_ids() + [document.folder_id]:
+                deltas[pk][0] += document.file_size
+                deltas[pk][1] += 1
+    for folder in folders:
+        for pk in folder.ancestor_ids():
+            deltas[pk][2] += 1
+    return deltas
+
+
+def apply_totals(deltas):
+    """
+    Adds the (bytes, documents, folders) `deltas` keyed by folder id to the
+    stored totals with a single UPDATE.
+    """
+    updates = {}
+    for i, field in enumerate(["total_bytes", "document_count", "folder_count"]):
+        whens = [When(pk=pk, then=Value(delta[i])) for pk, delta in deltas.items() if delta[i]]
+        if whens:
+            updates[field] = F(field) + Case(*whens, default=Value(0), output_field=models.BigIntegerField())
+    if updates:
+        Folder.objects.filter(pk__in=deltas).update(**updates)
+
+
+def ingest(user, root, entries):
+    """
+    Stores `entries` as documents below `root` (None for the top level),
+    creating the folders their paths name. Quota is reserved once, names
+    are checked in one query, folders and documents are bulk created, and
+    totals, timestamps and shares are each applied once for the batch.
+    Returns the created documents.
+    """
+    if len(entries) > settings.DOCUMENTS_BATCH_MAX_FILES:
+        raise BatchUploadError(f"A batch can hold at most {settings.DOCUMENTS_BATCH_MAX_FILES} files.")
+    paths = [entry.path for entry in entries]
+    if len(set(paths)) != len(paths):
+        raise DuplicateDocumentNameError("The batch contains the same file twice.")
+    total = sum(entry.size for entry in entries)
+    if not user.storage.reserve(total):
+        raise BatchUploadError("Files will exceed storage capacity.")
+    stored = []
+    try:
+        with transaction.atomic():
+            folders, created = ensure_folders(user, root, {path[:-1] for path in paths})
+            check_duplicates(folders, entries)
+            documents = []
+            for entry in entries:
+                documents.append(build_document(user, folders[entry.path[:-1]], entry))
+                stored.append(documents[-1].file.name)
+            Document.objects.bulk_create(documents)
+            documents = fetch_created(folders, entries)
+            PendingIndexUpdate.enqueue(document.pk for document in documents)
+
+            deltas = batch_deltas(created, documents)
+            apply_totals(deltas)
+            Folder.objects.filter(pk__in=deltas).touch(user)
+            share_batch(root, created, documents)
+    except Exception:
+        user.storage.release(total)
+        queue_file_deletions(stored)
+        raise
+    return documents
+
+
+def fetch_created(folders, entries):
+    # bulk_create does not set primary keys on every backend
+    by_folder = collections.defaultdict(set)
+    for entry in entries:
+        by_folder[folders[entry.path[:-1]]].add(entry.path[-1])
+    query = Q()
+    for folder, names in by_folder.items():
+        query |= Q(folder=folder, name__in=names)
+    return list(Document.objects.filter(query, trashed__isnull=True).select_related("folder"))
+
+
+def share_batch(root, folders, documents):
+    """
+    Shares the new items with the users of the shared hierarchy they were
+    added to, once for the whole batch.
+    """
+    if root is None or settings.DOCUMENTS_INHERITED_SHARING:
+        return
+    user_ids = list(root.shared_parent().shared_with().values_list("pk", flat=True))
+    if not user_ids:
+        return
+    FolderSharedUser.grant(Folder.objects.filter(pk__in=[folder.pk for folder in folders]), user_ids)
+    DocumentSharedUser.grant(
+        Document.objects.filter(pk__in=[document.pk for document in documents]),
+        user_ids,
+        skip_authors=False,
+    )
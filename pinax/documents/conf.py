@@ -23,6 +23,56 @@ def load_path_attr(path):
 class DocumentsAppConf(AppConf):
 
     USE_X_ACCEL_REDIRECT = False
+    SHARE_BATCH_SIZE = 1000
+    PAGE_SIZE = 100
+    DOWNLOAD_CHUNK_SIZE = 64 * 1024
+    DOWNLOAD_MAX_RANGES = 16
+    DOWNLOAD_BACKEND = None
+    X_ACCEL_REDIRECT_PREFIX = ""
+    X_ACCEL_BUFFERING = None
+    X_ACCEL_LIMIT_RATE = None
+    SIGNED_URL_EXPIRE = 300
+    # content type prefixes written to folder archives without compression
+    ARCHIVE_STORED_TYPES = [
+        "image/jpeg",
+        "image/png",
+        "image/gif",
+        "image/webp",
+        "audio/",
+        "video/",
+        "application/pdf",
+        "application/zip",
+        "application/gzip",
+        "application/x-gzip",
+        "application/x-bzip2",
+        "application/x-xz",
+        "application/x-7z-compressed",
+        "application/x-rar-compressed",
+        "application/vnd.rar",
+        "application/epub+zip",
+        "application/vnd.openxmlformats-officedocument.",
+        "application/vnd.oasis.opendocument.",
+    ]
+    UPLOAD_MAX_CHUNK_SIZE = 16 * 1024 * 1024
+    UPLOAD_SESSION_EXPIRE = 24 * 60 * 60
+    BATCH_MAX_FILES = 1000
+    COPY_BATCH_SIZE = 1000
+    CONTENT_ADDRESSED_STORAGE = False
+    DELETION_BATCH_SIZE = 1000
+    DELETION_MAX_ATTEMPTS = 10
+    TRASH = False
+    TRASH_RETENTION = 30
+    TOUCH_INTERVAL = 0
+    INHERITED_SHARING = False
+    SHARE_CACHE = False
+    SHARE_CACHE_ALIAS = "default"
+    SHARE_CACHE_TIMEOUT = 60 * 60
+    ASYNC_THREADS = 10
+    SEARCH_BACKEND = None
+    SEARCH_CONFIG = "simple"
+    SEARCH_MAX_TEXT_LENGTH = 500000
+    SEARCH_BATCH_SIZE = 100
+    SEARCH_MAX_ATTEMPTS = 5
     HOOKSET = "pinax.documents.hooks.DocumentsDefaultHookSet"
 
     def configure_hookset(self, value):
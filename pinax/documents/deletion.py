@@ -0,0 +1,144 @@
+import itertools
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import sharecache
+from .conf import settings
+from .indexing import remove_from_index
+from .models import (
+    Document,
+    DocumentSharedUser,
+    Folder,
+    FolderSharedUser,
+    PendingFileDeletion,
+    UploadSession,
+    UserStorage,
+)
+
+
+def queue_file_deletions(names):
+    """
+    Queues stored file `names` for removal by the background worker.
+    """
+    batch_size = settings.DOCUMENTS_DELETION_BATCH_SIZE
+    rows = (PendingFileDeletion(name=name) for name in names)
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        PendingFileDeletion.objects.bulk_create(batch)
+
+
+def release_storage(documents):
+    """
+    Gives back the quota used by `documents` with one UPDATE per author.
+    """
+    usage = documents.order_by().values("author").annotate(bytes=Coalesce(Sum("file_size"), 0))
+    for row in usage:
+        UserStorage.objects.filter(user=row["author"]).update(bytes_used=F("bytes_used") - row["bytes"])
+
+
+def delete_documents(documents):
+    """
+    Deletes the `documents` queryset with set-based SQL, releasing quota once
+    per author and queueing stored files for the background worker instead of
+    deleting them inline. Folder totals are left to the caller.
+    """
+    release_storage(documents)
+    queue_file_deletions(documents.order_by().values_list("file", flat=True).distinct().iterator())
+    shares = DocumentSharedUser.objects.filter(document__in=documents.values("pk"))
+    sharecache.shares_removed(shares)
+    shares.delete()
+    remove_from_index(documents)
+    # a single DELETE without collecting instances, so the per-instance
+    # pre_delete receivers don't delete files inline (they are queued
+    # above). Nothing cascades: the shares and index queue rows, the only
+    # rows referencing documents, are removed above. QuerySet.delete()
+    # would fetch every row to send the signals.
+    documents._raw_delete(documents.db)
+
+
+def delete_folder_contents(folder):
+    """
+    Removes everything below `folder` in a constant number of statements.
+    The folder itself is left for the caller to delete.
+    """
+    with transaction.atomic():
+        totals = Folder.objects.filter(pk=folder.pk).values("total_bytes", "document_count", "folder_count").get()
+        folders = Folder.objects.in_subtree(folder)
+        delete_documents(Document.objects.in_subtree(folder))
+        # sessions in `folder` itself too, or the cascade would skip
+        # UploadSession.delete() and keep their quota reserved
+        for session in UploadSession.objects.filter(folder__path__subtree=folder.path):
+            session.delete()
+        shares = FolderSharedUser.objects.filter(folder__in=folders.values("pk"))
+        sharecache.shares_removed(shares)
+        shares.delete()
+        folders.delete()
+        folder.update_totals(
+            bytes=-totals["total_bytes"],
+            documents=-totals["document_count"],
+            folders=-totals["folder_count"],
+        )
+
+
+def purge_trash(before, limit=None):
+    """
+    Permanently deletes items trashed before `before`: topmost trashed
+    folders one at a time, then loose documents in batches. Returns
+    (folders, documents) purged.
+    """
+    limit = limit or settings.DOCUMENTS_DELETION_BATCH_SIZE
+    roots = Folder.objects.filter(trashed__lt=before).exclude(parent__trashed__isnull=False)
+    purged_folders = 0
+    for folder in roots.order_by("trashed")[:limit]:
+        with transaction.atomic():
+            delete_folder_contents(folder)
+            folder.delete()
+        purged_folders += 1
+    documents = Document.objects.filter(trashed__lt=before).exclude(folder__trashed__isnull=False)
+    pks = list(documents.order_by("trashed").values_list("pk", flat=True)[:limit])
+    with transaction.atomic():
+        documents = Document.objects.filter(pk__in=pks)
+        totals = list(
+            documents.exclude(folder=None).order_by().values("folder")
+            .annotate(bytes=Coalesce(Sum("file_size"), 0), count=Count("pk"))
+        )
+        delete_documents(documents)
+        for folder in Folder.objects.in_bulk([row["folder"] for row in totals]).values():
+            row = next(row for row in totals if row["folder"] == folder.pk)
+            folder.update_totals(bytes=-row["bytes"], documents=-row["count"])
+    return purged_folders, len(pks)
+
+
+def process_file_deletions(limit=None):
+    """
+    Deletes queued stored files that no document references any more.
+    Failures are retried with exponential backoff up to
+    DOCUMENTS_DELETION_MAX_ATTEMPTS times. Returns (deleted, failed).
+    """
+    deleted = failed = 0
+    now = timezone.now()
+    pending = PendingFileDeletion.objects.filter(
+        next_attempt__lte=now,
+        attempts__lt=settings.DOCUMENTS_DELETION_MAX_ATTEMPTS,
+    ).order_by("next_attempt")
+    storage = Document._meta.get_field("file").storage
+    for entry in pending[:limit or settings.DOCUMENTS_DELETION_BATCH_SIZE]:
+        if not Document.objects.filter(file=entry.name).exists():
+            try:
+                storage.delete(entry.name)
+            except Exception as e:
+                entry.attempts += 1
+                entry.last_error = str(e)
+                entry.next_attempt = now + timedelta(seconds=2 ** entry.attempts)
+                entry.save()
+                failed += 1
+                continue
+            deleted += 1
+        entry.delete()
+    return deleted, failed
@@ -0,0 +1,423 @@
+import inspect
+import posixpath
+import re
+import uuid
+import zipfile
+from calendar import timegm
+from urllib.parse import quote
+
+from django.db.models import F
+from django.http import (
+    FileResponse,
+    HttpResponse,
+    HttpResponseRedirect,
+    StreamingHttpResponse,
+)
+from django.utils.cache import (
+    add_never_cache_headers,
+    get_conditional_response,
+)
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+
+from .conf import load_path_attr, settings
+from .models import Document, Folder
+
+RANGE_RE = re.compile(r"^\s*(\d*)\s*-\s*(\d*)\s*$")
+
+
+def content_disposition(filename, disposition="attachment"):
+    """
+    Returns a Content-Disposition header value for `filename`.
+    """
+    try:
+        filename.encode("ascii")
+    except UnicodeEncodeError:
+        return f"{disposition}; filename*=utf-8''{quote(filename)}"
+    filename = filename.replace("\\", "\\\\").replace('"', r"\"")
+    return f'{disposition}; filename="{filename}"'
+
+
+def parse_range(header, size):
+    """
+    Parses an HTTP Range header into a list of inclusive (start, end)
+    byte positions. Returns None when the header should be ignored and an
+    empty list when no range is satisfiable.
+    """
+    unit, _, ranges = header.partition("=")
+    if unit.strip() != "bytes":
+        return None
+    parsed = []
+    for spec in ranges.split(","):
+        match = RANGE_RE.match(spec)
+        if not match or match.groups() == ("", ""):
+            return None
+        first, last = match.groups()
+        if first == "":
+            start, end = max(size - int(last), 0), size - 1
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+            if last and int(last) < start:
+                return None
+        if start < size and start <= end:
+            parsed.append((start, end))
+    return merge_ranges(parsed)
+
+
+def merge_ranges(ranges):
+    """
+    Sorts `ranges` and coalesces the ones that overlap or touch, so no byte
+    is sent twice.
+    """
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def iter_range(f, start, end, chunk_size):
+    """
+    Yields bytes `start` to `end` (inclusive) of `f` in chunks of at most `chunk_size`.
+    """
+    f.seek(start)
+    remaining = end - start + 1
+    while remaining > 0:
+        chunk = f.read(min(chunk_size, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+
+class DocumentStream:
+    """
+    Streams a document straight from its storage backend in fixed-size
+    chunks, answering conditional and Range requests from the metadata
+    stored on the document.
+    """
+
+    def __init__(self, request, document):
+        self.request = request
+        self.document = document
+        self.size = document.size
+        self.content_type = document.content_type or "application/octet-stream"
+        self.chunk_size = settings.DOCUMENTS_DOWNLOAD_CHUNK_SIZE
+
+    @property
+    def etag(self):
+        if self.document.checksum:
+            return f'"{self.document.checksum}"'
+        return None
+
+    @property
+    def last_modified(self):
+        return timegm(self.document.modified.utctimetuple())
+
+    def response(self):
+        response = get_conditional_response(
+            self.request,
+            etag=self.etag,
+            last_modified=self.last_modified,
+        )
+        if response is None:
+            ranges = self.requested_ranges()
+            if ranges is None:
+                response = self.full_response()
+            elif not ranges:
+                response = HttpResponse(status=416)
+                response["Content-Range"] = f"bytes */{self.size}"
+            elif len(ranges) == 1:
+                response = self.single_range_response(*ranges[0])
+            else:
+                response = self.multipart_response(ranges)
+        if self.etag:
+            response["ETag"] = self.etag
+        response["Last-Modified"] = http_date(self.last_modified)
+        response["Accept-Ranges"] = "bytes"
+        return response
+
+    def requested_ranges(self):
+        header = self.request.META.get("HTTP_RANGE")
+        if not header or not self.if_range_passes():
+            return None
+        ranges = parse_range(header, self.size)
+        if ranges and len(ranges) > settings.DOCUMENTS_DOWNLOAD_MAX_RANGES:
+            # answer with the whole file rather than many small parts
+            return None
+        return ranges
+
+    def if_range_passes(self):
+        if_range = self.request.META.get("HTTP_IF_RANGE")
+        if not if_range:
+            return True
+        if if_range.startswith(('"', "W/")):
+            return self.etag is not None and parse_etags(if_range) == [self.etag]
+        return parse_http_date_safe(if_range) == self.last_modified
+
+    def open(self):
+        return self.document.file.storage.open(self.document.file.name, "rb")
+
+    def full_response(self):
+        response = FileResponse(
+            self.open(),
+            content_type=self.content_type,
+            as_attachment=True,
+            filename=self.document.original_filename,
+        )
+        response.block_size = self.chunk_size
+        response["Content-Length"] = self.size
+        response["Content-Disposition"] = content_disposition(self.document.original_filename or self.document.name)
+        return response
+
+    def single_range_response(self, start, end):
+        f = self.open()
+
+        def content():
+            try:
+                yield from iter_range(f, start, end, self.chunk_size)
+            finally:
+                f.close()
+
+        response = StreamingHttpResponse(content(), status=206, content_type=self.content_type)
+        response["Content-Length"] = end - start + 1
+        response["Content-Range"] = f"bytes {start}-{end}/{self.size}"
+        response["Content-Disposition"] = content_disposition(self.document.original_filename or self.document.name)
+        return response
+
+    def multipart_response(self, ranges):
+        boundary = uuid.uuid4().hex
+        headers = [
+            (
+                f"--{boundary}\r\n"
+                f"Content-Type: {self.content_type}\r\n"
+                f"Content-Range: bytes {start}-{end}/{self.size}\r\n\r\n"
+            ).encode()
+            for start, end in ranges
+        ]
+        tail = f"\r\n--{boundary}--\r\n".encode()
+        length = sum(len(h) for h in headers) + sum(end - start + 1 for start, end in ranges)
+        length += 2 * (len(ranges) - 1) + len(tail)
+        f = self.open()
+
+        def parts():
+            try:
+                for i, (start, end) in enumerate(ranges):
+                    if i:
+                        yield b"\r\n"
+                    yield headers[i]
+                    yield from iter_range(f, start, end, self.chunk_size)
+                yield tail
+            finally:
+                f.close()
+
+        response = StreamingHttpResponse(
+            parts(),
+            status=206,
+            content_type=f"multipart/byteranges; boundary={boundary}",
+        )
+        response["Content-Length"] = length
+        return response
+
+
+def serve(request, document):
+    """
+    Returns a streaming response for `document` that works with any storage backend.
+    """
+    return DocumentStream(request, document).response()
+
+
+class ArchiveBuffer:
+    """
+    A write-only file for zipfile that hands over what has been written so
+    far. Without seek() zipfile writes each member in one pass, followed by
+    a data descriptor, and never goes back.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+def compress_type(content_type):
+    if content_type.startswith(tuple(settings.DOCUMENTS_ARCHIVE_STORED_TYPES)):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def iter_archive(members, chunk_size):
+    """
+    Yields a zip archive of `members`, (archive path, document) pairs, while
+    it is written. At most one chunk of one file is held in memory.
+    """
+    buffer = ArchiveBuffer()
+    with zipfile.ZipFile(buffer, "w", allowZip64=True) as archive:
+        for path, document in members:
+            info = zipfile.ZipInfo(path, date_time=document.modified.timetuple()[:6])
+            info.compress_type = compress_type(document.content_type)
+            # lets zipfile decide up front whether the member needs zip64
+            info.file_size = document.size
+            with document.file.storage.open(document.file.name, "rb") as f, archive.open(info, "w") as member:
+                for chunk in iter(lambda: f.read(chunk_size), b""):
+                    member.write(chunk)
+                    data = buffer.drain()
+                    if data:
+                        yield data
+            yield buffer.drain()
+    yield buffer.drain()
+
+
+def archive_name(name):
+    """
+    Returns `name` made safe as a single archive path component: separators
+    are replaced and names such as ".." cannot step out of the extraction
+    directory.
+    """
+    name = name.replace("/", "_").replace("\\", "_")
+    if not name.strip("."):
+        name = name.replace(".", "_") or "_"
+    return name
+
+
+def archive_members(folder, user):
+    """
+    Returns (archive path, document) pairs for the documents below `folder`
+    that `user` can access, checked with a single for_user query for the
+    whole subtree. Archive paths follow the folder hierarchy, one sanitized
+    component per name.
+    """
+    names = dict(Folder.objects.filter(path__subtree=folder.path).values_list("pk", "name"))
+    depth = len(folder.ancestor_ids())
+    documents = Document.objects.for_user(user).in_subtree(folder).annotate(folder_path=F("folder__path"))
+    for document in documents.order_by("folder__path", "name").iterator():
+        ids = [int(pk) for pk in document.folder_path.split("/") if pk][depth:]
+        parts = [names[pk] for pk in ids] + [document.name]
+        yield posixpath.join(*(archive_name(part) for part in parts)), document
+
+
+def serve_folder(request, folder):
+    """
+    Returns a response streaming a zip archive of everything in `folder`
+    the requesting user can access.
+    """
+    response = StreamingHttpResponse(
+        iter_archive(archive_members(folder, request.user), settings.DOCUMENTS_DOWNLOAD_CHUNK_SIZE),
+        content_type="application/zip",
+    )
+    response["Content-Disposition"] = content_disposition(f"{folder.name}.zip")
+    return response
+
+
+class DownloadBackend:
+    """
+    Base class for the backends selected by DOCUMENTS_DOWNLOAD_BACKEND.
+    """
+
+    def response(self, request, document):
+        raise NotImplementedError()
+
+    def attachment_headers(self, response, document):
+        if document.content_type:
+            response["Content-Type"] = document.content_type
+        else:
+            # let the web server determine the content type
+            del response["Content-Type"]
+        response["Content-Disposition"] = content_disposition(document.original_filename or document.name)
+        return response
+
+
+class StreamingBackend(DownloadBackend):
+    """
+    Streams the file through Django; works with any storage backend.
+    """
+
+    def response(self, request, document):
+        return serve(request, document)
+
+
+class XSendfileBackend(DownloadBackend):
+    """
+    Hands the file off to Apache (mod_xsendfile) or lighttpd by its
+    filesystem path. Requires a storage backend that implements `path()`.
+    """
+
+    header = "X-Sendfile"
+
+    def response(self, request, document):
+        response = HttpResponse()
+        response[self.header] = document.file.path
+        return self.attachment_headers(response, document)
+
+
+class XAccelRedirectBackend(DownloadBackend):
+    """
+    Hands the file off to nginx. The redirect target is the file name under
+    DOCUMENTS_X_ACCEL_REDIRECT_PREFIX (an `internal` location) or, when no
+    prefix is set, the file URL.
+    """
+
+    def response(self, request, document):
+        response = HttpResponse()
+        prefix = settings.DOCUMENTS_X_ACCEL_REDIRECT_PREFIX
+        if prefix:
+            response["X-Accel-Redirect"] = prefix.rstrip("/") + "/" + quote(document.file.name)
+        else:
+            response["X-Accel-Redirect"] = document.file.url
+        if settings.DOCUMENTS_X_ACCEL_BUFFERING is not None:
+            response["X-Accel-Buffering"] = "yes" if settings.DOCUMENTS_X_ACCEL_BUFFERING else "no"
+        if settings.DOCUMENTS_X_ACCEL_LIMIT_RATE is not None:
+            response["X-Accel-Limit-Rate"] = settings.DOCUMENTS_X_ACCEL_LIMIT_RATE
+        return self.attachment_headers(response, document)
+
+
+class SignedRedirectBackend(DownloadBackend):
+    """
+    Redirects to a signed, expiring URL on object storage (for example
+    django-storages' S3 or Azure backends), valid for
+    DOCUMENTS_SIGNED_URL_EXPIRE seconds.
+    """
+
+    def response(self, request, document):
+        storage = document.file.storage
+        params = inspect.signature(storage.url).parameters
+        kwargs = {}
+        if "expire" in params:
+            kwargs["expire"] = settings.DOCUMENTS_SIGNED_URL_EXPIRE
+        if "parameters" in params:
+            kwargs["parameters"] = {
+                "ResponseContentDisposition": content_disposition(document.original_filename or document.name),
+            }
+            if document.content_type:
+                kwargs["parameters"]["ResponseContentType"] = document.content_type
+        response = HttpResponseRedirect(storage.url(document.file.name, **kwargs))
+        add_never_cache_headers(response)
+        return response
+
+
+def get_backend():
+    """
+    Returns the download backend selected by DOCUMENTS_DOWNLOAD_BACKEND.
+    """
+    path = settings.DOCUMENTS_DOWNLOAD_BACKEND
+    if path is None:
+        if settings.DOCUMENTS_USE_X_ACCEL_REDIRECT:
+            return XAccelRedirectBackend()
+        return StreamingBackend()
+    return load_path_attr(path)()
@@ -4,3 +4,23 @@ class DuplicateFolderNameError(Exception):
 
 class DuplicateDocumentNameError(Exception):
     pass
+
+
+class BatchUploadError(Exception):
+    pass
+
+
+class InvalidMoveError(Exception):
+    pass
+
+
+class QuotaExceededError(Exception):
+    pass
+
+
+class FolderDepthError(Exception):
+    pass
+
+
+class TrashedParentError(Exception):
+    pass
@@ -0,0 +1,83 @@
+import re
+import zipfile
+from xml.etree import ElementTree
+
+from .conf import settings
+from .utils import guess_content_type
+
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+
+# the parts of Office Open XML and OpenDocument files that hold text
+OFFICE_PARTS = re.compile(
+    r"^(word/(document|header\d*|footer\d*|footnotes)\.xml"
+    r"|xl/sharedStrings\.xml"
+    r"|ppt/slides/slide\d+\.xml"
+    r"|content\.xml)$"
+)
+
+
+def collect(pieces, limit):
+    """
+    Joins text `pieces` until `limit` characters have been collected.
+    """
+    text, size = [], 0
+    for piece in pieces:
+        text.append(piece)
+        size += len(piece) + 1
+        if size >= limit:
+            break
+    return "\n".join(text)[:limit]
+
+
+def extract_plain_text(f, limit):
+    return f.read(limit).decode("utf-8", "replace")
+
+
+def extract_pdf(f, limit):
+    """
+    Returns the text layer of a PDF. Requires pypdf; without it PDFs are
+    indexed by name only.
+    """
+    if pypdf is None:
+        return ""
+    return collect((page.extract_text() or "" for page in pypdf.PdfReader(f).pages), limit)
+
+
+def extract_office_xml(f, limit):
+    """
+    Returns the text of a .docx, .xlsx, .pptx or OpenDocument file, parsing
+    its XML parts incrementally.
+    """
+    def pieces(archive):
+        for name in archive.namelist():
+            if OFFICE_PARTS.match(name):
+                with archive.open(name) as part:
+                    for _, element in ElementTree.iterparse(part):
+                        if element.text and element.text.strip():
+                            yield element.text
+                        element.clear()
+
+    with zipfile.ZipFile(f) as archive:
+        return collect(pieces(archive), limit)
+
+
+EXTRACTORS = [
+    (("text/", "application/json", "application/xml"), extract_plain_text),
+    (("application/pdf",), extract_pdf),
+    (("application/vnd.openxmlformats-officedocument.", "application/vnd.oasis.opendocument."), extract_office_xml),
+]
+
+
+def extract_text(document, f):
+    """
+    Returns the searchable text of `document`, read from the open file `f`,
+    or an empty string for content types without an extractor.
+    """
+    content_type = document.content_type or guess_content_type(document.name)
+    for prefixes, extractor in EXTRACTORS:
+        if content_type.startswith(prefixes):
+            return extractor(f, settings.DOCUMENTS_SEARCH_MAX_TEXT_LENGTH)
+    return ""
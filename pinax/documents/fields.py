@@ -0,0 +1,32 @@
+from django.db import models
+from django.db.models import Lookup
+from django.db.models.lookups import StartsWith
+
+
+class PathField(models.CharField):
+    """
+    A materialized path of ancestor ids, e.g. "1/5/9/". Supports a `subtree`
+    lookup matching the path and every path below it.
+    """
+
+
+@PathField.register_lookup
+class Subtree(Lookup):
+    """
+    `path__subtree="1/5/"` matches "1/5/" and "1/5/9/" but not "1/50/".
+    PostgreSQL and MySQL answer LIKE 'prefix%' from the index, so other
+    backends use startswith.
+    """
+    lookup_name = "subtree"
+
+    def as_sql(self, compiler, connection):
+        return StartsWith(self.lhs, self.rhs).as_sql(compiler, connection)
+
+    def as_sqlite(self, compiler, connection):
+        # SQLite never uses an index for LIKE ... ESCAPE, but does for a range
+        # on the (binary collated) column
+        lhs, params = self.process_lhs(compiler, connection)
+        if not self.rhs:
+            return f"{lhs} >= %s", params + [""]
+        upper = self.rhs[:-1] + chr(ord(self.rhs[-1]) + 1)
+        return f"({lhs} >= %s AND {lhs} < %s)", params + [self.rhs, upper]
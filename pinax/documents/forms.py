@@ -1,7 +1,7 @@
 from django import forms
 
 from .hooks import hookset
-from .models import Document, Folder
+from .models import Document, Folder, UploadSession
 
 try:
     from account.utils import user_display
@@ -72,6 +72,81 @@ class DocumentCreateFormWithName(DocumentCreateForm):
         }
 
 
+class DocumentBatchForm(forms.Form):
+
+    folder = forms.ModelChoiceField(queryset=None, required=False)
+    archive = forms.FileField(required=False)
+
+    def __init__(self, *args, **kwargs):
+        folders = kwargs.pop("folders")
+        super().__init__(*args, **kwargs)
+        self.fields["folder"].queryset = folders
+
+    def clean(self):
+        files = self.files.getlist("files") if self.files else []
+        if not files and not self.cleaned_data.get("archive"):
+            raise forms.ValidationError("Upload files or a zip archive.")
+        self.cleaned_data["files"] = files
+        return self.cleaned_data
+
+
+class MoveForm(forms.Form):
+
+    folder = forms.ModelChoiceField(queryset=None, required=False)
+
+    def __init__(self, *args, **kwargs):
+        folders = kwargs.pop("folders")
+        super().__init__(*args, **kwargs)
+        self.fields["folder"].queryset = folders
+
+
+class FolderRenameForm(forms.Form):
+
+    name = forms.CharField(max_length=Folder._meta.get_field("name").max_length)
+
+
+class DocumentRenameForm(forms.Form):
+
+    name = forms.CharField(max_length=Document._meta.get_field("name").max_length)
+
+
+class DocumentUploadForm(forms.ModelForm):
+
+    class Meta:
+        model = UploadSession
+        fields = ["folder", "name", "size"]
+
+    def __init__(self, *args, **kwargs):
+        folders = kwargs.pop("folders")
+        self.storage = kwargs.pop("storage")
+        super().__init__(*args, **kwargs)
+        self.fields["folder"].queryset = folders
+
+    def clean_size(self):
+        value = self.cleaned_data["size"]
+        if value < 0:
+            raise forms.ValidationError("Size cannot be negative.")
+        if (value + self.storage.bytes_used) > self.storage.bytes_total:
+            raise forms.ValidationError("File will exceed storage capacity.")
+        return value
+
+    def clean(self):
+        if "name" in self.cleaned_data:
+            name = self.cleaned_data.get("name")
+            folder = self.cleaned_data.get("folder")
+            if Document.already_exists(name, folder):
+                raise forms.ValidationError(
+                    hookset.already_exists_validation_message(name, folder)
+                )
+
+
+class DocumentUploadCommitForm(DocumentCreateForm):
+
+    def clean_file(self):
+        # quota was reserved when the upload session was created
+        return self.cleaned_data["file"]
+
+
 class UserMultipleChoiceField(forms.ModelMultipleChoiceField):
 
     def label_from_instance(self, obj):
@@ -97,3 +172,11 @@ class ColleagueFolderShareForm(FolderShareForm):
         colleagues = kwargs.pop("colleagues")
         super().__init__(*args, **kwargs)
         self.fields["participants"].queryset = colleagues
+
+
+class FolderUnshareForm(FolderShareForm):
+
+    def __init__(self, *args, **kwargs):
+        participants = kwargs.pop("participants")
+        super().__init__(*args, **kwargs)
+        self.fields["participants"].queryset = participants
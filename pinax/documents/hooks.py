@@ -6,6 +6,7 @@ from django.contrib.auth import get_user_model
 from django.utils.translation import gettext as _
 
 from .conf import settings
+from .extraction import extract_text
 
 
 class DocumentsDefaultHookSet:
@@ -23,6 +24,13 @@ class DocumentsDefaultHookSet:
         """
         return folder.parent_id is None and folder.author_id == user.id
 
+    def extract_text(self, document, f):
+        """
+        Return the text of `document`, read from the open file `f`, for the
+        search index.
+        """
+        return extract_text(document, f)
+
     def storage_color(self, user_storage):
         """
         Return labels indicating amount of storage used.
@@ -72,14 +80,54 @@ class DocumentsDefaultHookSet:
         """
         messages.success(request, _("Folder has been deleted"))
 
+    def document_restored_message(self, request, document):
+        """
+        Send messages.success message after restoring a document from the trash.
+        """
+        messages.success(request, _("Document has been restored"))
+
+    def folder_restored_message(self, request, folder):
+        """
+        Send messages.success message after restoring a folder from the trash.
+        """
+        messages.success(request, _("Folder has been restored"))
+
+    def document_moved_message(self, request, document):
+        """
+        Send messages.success message after moving a document.
+        """
+        messages.success(request, _("Document has been moved"))
+
+    def folder_moved_message(self, request, folder):
+        """
+        Send messages.success message after moving a folder.
+        """
+        messages.success(request, _("Folder has been moved"))
+
+    def document_renamed_message(self, request, document):
+        """
+        Send messages.success message after renaming a document.
+        """
+        messages.success(request, _("Document has been renamed"))
+
+    def folder_copied_message(self, request, folder):
+        """
+        Send messages.success message after copying a folder.
+        """
+        messages.success(request, _("Folder has been copied"))
+
+    def folder_renamed_message(self, request, folder):
+        """
+        Send messages.success message after renaming a folder.
+        """
+        messages.success(request, _("Folder has been renamed"))
+
     def folder_pre_delete(self, request, folder):
         """
         Perform folder operations prior to deletions. For example, deleting all contents.
         """
-        for m in folder.members():
-            if m.__class__ == folder.__class__:
-                self.folder_pre_delete(request, m)
-            m.delete()
+        from .deletion import delete_folder_contents
+        delete_folder_contents(folder)
 
     def file_upload_to(self, instance, filename):
         """
@@ -89,6 +137,13 @@ class DocumentsDefaultHookSet:
         filename = f"{uuid.uuid4()}.{ext}"
         return os.path.join("document", filename)
 
+    def blob_upload_to(self, digest, filename):
+        """
+        Storage name of a content-addressed blob; used when
+        DOCUMENTS_CONTENT_ADDRESSED_STORAGE is enabled.
+        """
+        return os.path.join("blobs", digest[:2], digest[2:4], digest)
+
     def already_exists_validation_message(self, name, folder):
         return f"{name} already exists."
 
@@ -0,0 +1,47 @@
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .conf import settings
+from .hooks import hookset
+from .models import Document, PendingIndexUpdate
+from .search import get_backend
+
+
+def remove_from_index(documents):
+    """
+    Drops the `documents` queryset from the search index and the queue.
+    """
+    get_backend(documents.db).remove(documents)
+    PendingIndexUpdate.objects.filter(document__in=documents.values("pk")).delete()
+
+
+def process_search_index(limit=None):
+    """
+    Extracts and indexes the text of queued documents. Failures are retried
+    with exponential backoff up to DOCUMENTS_SEARCH_MAX_ATTEMPTS times.
+    Returns (indexed, failed).
+    """
+    indexed = failed = 0
+    now = timezone.now()
+    pending = PendingIndexUpdate.objects.filter(
+        next_attempt__lte=now,
+        attempts__lt=settings.DOCUMENTS_SEARCH_MAX_ATTEMPTS,
+    ).select_related("document").order_by("next_attempt")
+    backend = get_backend(Document.objects.db)
+    for entry in pending[:limit or settings.DOCUMENTS_SEARCH_BATCH_SIZE]:
+        document = entry.document
+        try:
+            with document.file.storage.open(document.file.name, "rb") as f:
+                text = hookset.extract_text(document, f)
+            backend.index(document, text)
+        except Exception as e:
+            entry.attempts += 1
+            entry.last_error = str(e)
+            entry.next_attempt = now + timedelta(seconds=2 ** entry.attempts)
+            entry.save()
+            failed += 1
+            continue
+        entry.delete()
+        indexed += 1
+    return indexed, failed
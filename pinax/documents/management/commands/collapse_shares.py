@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from ...conf import settings
+from ...models import DocumentSharedUser, FolderSharedUser
+from ...utils import collapse_shares
+
+
+class Command(BaseCommand):
+    help = "Deletes share rows made redundant by inherited sharing."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        if not settings.DOCUMENTS_INHERITED_SHARING:
+            raise CommandError("Enable DOCUMENTS_INHERITED_SHARING before collapsing shares.")
+        with transaction.atomic(using=options["database"]):
+            count = collapse_shares(FolderSharedUser, DocumentSharedUser, options["database"], options["batch_size"])
+        self.stdout.write(f"Deleted {count} redundant share rows.")
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...deletion import process_file_deletions
+
+
+class Command(BaseCommand):
+    help = "Deletes stored files queued by bulk deletions, retrying failures."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", action="store_true", help="Keep polling for queued files.")
+        parser.add_argument("--interval", type=float, default=5, help="Seconds to sleep between polls.")
+
+    def handle(self, *args, **options):
+        while True:
+            deleted, failed = process_file_deletions()
+            if deleted or failed:
+                self.stdout.write(f"Deleted {deleted} files, {failed} failed.")
+            if not options["loop"]:
+                break
+            if not deleted and not failed:
+                time.sleep(options["interval"])
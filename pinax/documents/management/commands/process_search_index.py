@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...indexing import process_search_index
+
+
+class Command(BaseCommand):
+    help = "Extracts and indexes the text of documents queued for search, retrying failures."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", action="store_true", help="Keep polling for queued documents.")
+        parser.add_argument("--interval", type=float, default=5, help="Seconds to sleep between polls.")
+
+    def handle(self, *args, **options):
+        while True:
+            indexed, failed = process_search_index()
+            if indexed or failed:
+                self.stdout.write(f"Indexed {indexed} documents, {failed} failed.")
+            if not options["loop"]:
+                break
+            if not indexed and not failed:
+                time.sleep(options["interval"])
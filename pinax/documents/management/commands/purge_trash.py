@@ -0,0 +1,32 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ...conf import settings
+from ...deletion import purge_trash
+
+
+class Command(BaseCommand):
+    help = "Permanently deletes trashed folders and documents and frees their storage."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than",
+            type=int,
+            default=settings.DOCUMENTS_TRASH_RETENTION,
+            help="Days an item stays in the trash before it is purged.",
+        )
+        parser.add_argument("--limit", type=int, help="Items to purge per batch.")
+        parser.add_argument("--once", action="store_true", help="Purge a single batch and stop.")
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options["older_than"])
+        total_folders = total_documents = 0
+        while True:
+            folders, documents = purge_trash(before, limit=options["limit"])
+            total_folders += folders
+            total_documents += documents
+            if options["once"] or not (folders or documents):
+                break
+        self.stdout.write(f"Purged {total_folders} folders and {total_documents} documents.")
@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ...conf import settings
+from ...models import UploadSession
+
+
+class Command(BaseCommand):
+    help = "Deletes abandoned resumable uploads and gives back their reserved quota."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--max-age",
+            type=int,
+            default=settings.DOCUMENTS_UPLOAD_SESSION_EXPIRE,
+            help="Age in seconds after which an upload session is abandoned.",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=options["max_age"])
+        count = 0
+        for session in UploadSession.objects.filter(created__lt=cutoff).iterator():
+            session.delete()
+            count += 1
+        self.stdout.write(f"Purged {count} upload sessions.")
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from ...models import Folder
+from ...utils import build_folder_paths
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the materialized ancestry path of every folder."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        with transaction.atomic(using=options["database"]):
+            count = build_folder_paths(Folder, options["database"], options["batch_size"])
+        self.stdout.write(f"Updated {count} folder paths.")
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from ...models import Document, PendingIndexUpdate
+
+
+class Command(BaseCommand):
+    help = "Queues every document for the process_search_index worker."
+
+    def handle(self, *args, **options):
+        ids = Document.objects.order_by().values_list("pk", flat=True).iterator()
+        PendingIndexUpdate.enqueue(ids)
+        self.stdout.write(f"{PendingIndexUpdate.objects.count()} documents queued.")
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from ...models import Document, Folder
+from ...utils import build_folder_totals
+
+
+class Command(BaseCommand):
+    help = "Recomputes the stored size and item counts of every folder."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        with transaction.atomic(using=options["database"]):
+            count = build_folder_totals(Folder, Document, options["database"], options["batch_size"])
+        self.stdout.write(f"Corrected totals for {count} folders.")
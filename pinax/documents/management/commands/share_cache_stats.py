@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from ... import sharecache
+
+
+class Command(BaseCommand):
+    help = "Prints the hit and miss counters of the share-membership cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reset", action="store_true", help="Reset the counters after printing them.")
+
+    def handle(self, *args, **options):
+        stats = sharecache.stats()
+        total = stats["hits"] + stats["misses"]
+        ratio = stats["hits"] / total if total else 0
+        self.stdout.write(f"Hits: {stats['hits']}, misses: {stats['misses']}, hit ratio: {ratio:.1%}")
+        if options["reset"]:
+            sharecache.reset_stats()
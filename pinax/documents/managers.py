@@ -1,68 +1,226 @@
 import itertools
 import operator
+from collections import defaultdict
+from datetime import timedelta
 
 from django.apps import apps
-from django.db import models
-from django.db.models import Q
+from django.db import connections, models
+from django.db.models import (
+    BooleanField,
+    Case,
+    Exists,
+    OuterRef,
+    Q,
+    Value,
+    When,
+)
+from django.db.models.functions import Length, Substr
 from django.db.models.query import QuerySet
+from django.utils import timezone
+
+from .conf import settings
+from .search import get_backend as get_search_backend
+from .utils import SubquerySQL, decode_cursor, encode_cursor
+
+MEMBER_KINDS = ["folder", "document"]
+
+
+def shared_ids(model, user):
+    """
+    Returns a subquery selecting the ids of `model` rows shared with `user`.
+    The share cache is only used for point checks; inlining a user's cached
+    ids here would send every one of them as a query parameter.
+    """
+    shared_user_model = model.shared_user_model()
+    qs = shared_user_model._default_manager.filter(user=user)
+    return qs.values(shared_user_model.obj_attr)
+
+
+def shared_flag(model, user):
+    """
+    Returns an expression that is true for rows of `model` shared with `user`.
+    """
+    shared_user_model = model.shared_user_model()
+    qs = shared_user_model._default_manager.filter(user=user, **{shared_user_model.obj_attr: OuterRef("pk")})
+    return Exists(qs)
+
+
+def inherited_flag(user, path):
+    """
+    Returns an expression that is true when `user` holds a folder grant on
+    the folder whose materialized path is the outer field `path`, or on
+    one of its ancestors. Used when DOCUMENTS_INHERITED_SHARING is enabled.
+    """
+    FolderSharedUser = apps.get_model("documents", "FolderSharedUser")
+    grants = FolderSharedUser._default_manager.filter(
+        user=user,
+        folder__path=Substr(OuterRef(path), 1, Length("folder__path")),
+    )
+    return Exists(grants)
 
 
 class FolderManager(models.Manager):
 
+    def descendant_ids(self, folder):
+        """
+        Returns an expression selecting the ids of every folder below
+        `folder` (or every folder when `folder` is None) with a single
+        recursive query. Suitable for use with `__in` lookups.
+        """
+        qn = connections[self.db].ops.quote_name
+        table = qn(self.model._meta.db_table)
+        parent = qn(self.model._meta.get_field("parent").column)
+        pk = qn(self.model._meta.pk.column)
+        if folder is None:
+            anchor, params = f"{parent} IS NULL", ()
+        else:
+            anchor, params = f"{parent} = %s", (folder.pk,)
+        sql = (
+            f"WITH RECURSIVE subtree (id) AS ("
+            f"SELECT {pk} FROM {table} WHERE {anchor} "
+            f"UNION ALL "
+            f"SELECT f.{pk} FROM {table} f INNER JOIN subtree s ON f.{parent} = s.id"
+            f") SELECT id FROM subtree"
+        )
+        return SubquerySQL(sql, params)
+
     def members(self, folder, **kwargs):
         direct = kwargs.get("direct", True)
         user = kwargs.get("user")
         Document = apps.get_model("documents", "Document")
-        folders = self.filter(parent=folder)
-        documents = Document.objects.filter(folder=folder)
+        if direct:
+            folders = self.filter(parent=folder, trashed__isnull=True)
+            documents = Document.objects.filter(folder=folder, trashed__isnull=True)
+        else:
+            subtree = self.descendant_ids(folder)
+            folders = self.filter(pk__in=subtree, trashed__isnull=True).order_by("pk")
+            documents = Document.objects.filter(Q(folder=folder) | Q(folder__in=subtree), trashed__isnull=True)
         if user:
             folders = folders.for_user(user)
             documents = documents.for_user(user)
-        M = sorted(itertools.chain(folders, documents), key=operator.attrgetter("name"))
         if direct:
-            return M
+            return sorted(itertools.chain(folders, documents), key=operator.attrgetter("name"))
+        return self._flatten(folder, folders, documents)
+
+    def page(self, folder, user=None, cursor=None, limit=None):
+        """
+        Returns one page of the direct members of `folder`, ordered by
+        (kind, name, pk) with folders first, along with the cursor of the
+        next page (None on the last page). Each kind is read in index order
+        from the cursor onwards, with at most `limit + 1` rows per query, so
+        the cost of a page does not depend on the folder size.
+        """
+        limit = limit or settings.DOCUMENTS_PAGE_SIZE
+        after = decode_cursor(cursor) if cursor else None
+        Document = apps.get_model("documents", "Document")
+        members = []
+        for qs in [self.filter(parent=folder), Document.objects.filter(folder=folder)]:
+            qs = qs.for_user(user) if user else qs.filter(trashed__isnull=True)
+            qs = self._keyset(qs, after)
+            members.extend(qs.order_by("name", "pk")[:limit + 1 - len(members)])
+            if len(members) > limit:
+                break
+        next_cursor = None
+        if len(members) > limit:
+            members = members[:limit]
+            next_cursor = encode_cursor(members[-1].kind, members[-1].name, members[-1].pk)
+        return members, next_cursor
+
+    def _keyset(self, qs, after):
+        if after is None:
+            return qs
+        after_kind, after_name, after_pk = after
+        rank, after_rank = MEMBER_KINDS.index(qs.model.kind), MEMBER_KINDS.index(after_kind)
+        if rank < after_rank:
+            return qs.none()
+        if rank == after_rank:
+            return qs.filter(Q(name__gt=after_name) | Q(name=after_name, pk__gt=after_pk))
+        return qs
+
+    def _flatten(self, folder, folders, documents):
+        """
+        Orders a loaded subtree the same way a depth-first walk would: each
+        level sorted by name, followed by the contents of its child folders.
+        """
+        children, contents = defaultdict(list), defaultdict(list)
         for child in folders:
-            M.extend(self.members(child, **kwargs))
-        return M
+            children[child.parent_id].append(child)
+        for document in documents:
+            contents[document.folder_id].append(document)
+
+        def walk(pk):
+            M = sorted(itertools.chain(children[pk], contents[pk]), key=operator.attrgetter("name"))
+            for child in children[pk]:
+                M.extend(walk(child.pk))
+            return M
+
+        return walk(folder.pk if folder is not None else None)
 
 
 class FolderQuerySet(QuerySet):
 
-    def for_user(self, user):
+    def in_subtree(self, folder):
         """
-        All folders the given user can do something with.
+        All folders below `folder` (at any depth).
         """
-        qs = SharedMemberQuerySet(model=self.model, using=self._db, user=user)
-        qs = qs.filter(Q(author=user) | Q(foldershareduser__user=user))
-        return qs.distinct() & self.distinct()
-
+        return self.filter(path__subtree=folder.path).exclude(pk=folder.pk)
 
-class DocumentQuerySet(QuerySet):
+    def touch(self, user, when=None):
+        """
+        Bumps `modified` on every folder in the queryset with one UPDATE.
+        With DOCUMENTS_TOUCH_INTERVAL set, folders bumped less than that many
+        seconds ago are left alone.
+        """
+        when = when or timezone.now()
+        qs = self
+        if settings.DOCUMENTS_TOUCH_INTERVAL:
+            qs = qs.filter(modified__lt=when - timedelta(seconds=settings.DOCUMENTS_TOUCH_INTERVAL))
+        return qs.update(modified=when, modified_by=user)
 
-    def for_user(self, user):
+    def for_user(self, user, trashed=False):
         """
-        All documents the given user can do something with.
+        All folders the given user can do something with. Pass `trashed=True`
+        for the ones in the trash instead.
         """
-        qs = SharedMemberQuerySet(model=self.model, using=self._db, user=user)
-        qs = qs.filter(Q(author=user) | Q(documentshareduser__user=user))
-        return qs.distinct() & self.distinct()
+        if settings.DOCUMENTS_INHERITED_SHARING:
+            qs = self.annotate(_shared=inherited_flag(user, "path"))
+            return qs.filter(Q(author=user) | Q(_shared=True), trashed__isnull=not trashed)
+        qs = self.filter(Q(author=user) | Q(pk__in=shared_ids(self.model, user)), trashed__isnull=not trashed)
+        return qs.annotate(_shared=shared_flag(self.model, user))
 
 
-class SharedMemberQuerySet(QuerySet):
+class DocumentQuerySet(QuerySet):
 
-    def __init__(self, **kwargs):
-        if "user" in kwargs:
-            self.user = kwargs.pop("user")
-        super().__init__(**kwargs)
+    def in_subtree(self, folder):
+        """
+        All documents in `folder` or below it (at any depth).
+        """
+        return self.filter(folder__path__subtree=folder.path)
 
-    def iterator(self):
-        shared_user_model = self.model.shared_user_model()
-        shared_members = shared_user_model.for_user(self.user)
-        for obj in super().iterator():
-            if obj.pk in shared_members:
-                obj._shared = True
-            yield obj
+    def search(self, query):
+        """
+        Documents whose name or extracted text match `query`, best matches
+        first. Chain after for_user() to search what a user can access.
+        """
+        return get_search_backend(self.db).search(self, query)
 
-    def _chain(self, **kwargs):
-        kwargs["user"] = self.user
-        return super()._chain(**kwargs)
+    def for_user(self, user, trashed=False):
+        """
+        All documents the given user can do something with. Pass `trashed=True`
+        for the ones in the trash instead.
+        """
+        if settings.DOCUMENTS_INHERITED_SHARING:
+            # separate annotations rather than When(Exists(...)), which
+            # Django 2.2 cannot use as a condition
+            qs = self.annotate(
+                _direct=shared_flag(self.model, user),
+                _inherited=inherited_flag(user, "folder__path"),
+            ).annotate(_shared=Case(
+                When(Q(_direct=True) | Q(_inherited=True), then=Value(True)),
+                default=Value(False),
+                output_field=BooleanField(),
+            ))
+            shared = Q(_direct=True) | Q(_inherited=True)
+            return qs.filter(Q(author=user) | shared, trashed__isnull=not trashed)
+        qs = self.filter(Q(author=user) | Q(pk__in=shared_ids(self.model, user)), trashed__isnull=not trashed)
+        return qs.annotate(_shared=shared_flag(self.model, user))
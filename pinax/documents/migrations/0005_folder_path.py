@@ -0,0 +1,26 @@
+# Generated by Django 3.0.14 on 2026-10-18 14:13
+
+from django.db import migrations, models
+
+from pinax.documents.utils import build_folder_paths
+
+
+def populate_paths(apps, schema_editor):
+    Folder = apps.get_model("documents", "Folder")
+    build_folder_paths(Folder, schema_editor.connection.alias)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0004_auto_20161230_1057'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='folder',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(populate_paths, migrations.RunPython.noop),
+    ]
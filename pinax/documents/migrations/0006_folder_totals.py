@@ -0,0 +1,28 @@
+# Generated by Django 3.0.14 on 2026-10-18 14:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0005_folder_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='folder',
+            name='document_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='folder',
+            name='folder_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='folder',
+            name='total_bytes',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations
+
+from pinax.documents.utils import backfill_document_metadata
+
+
+def populate_metadata(apps, schema_editor):
+    Document = apps.get_model("documents", "Document")
+    backfill_document_metadata(Document, schema_editor.connection.alias)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0007_document_metadata'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_metadata, migrations.RunPython.noop)
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.0.14 on 2026-10-18 14:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0008_populate_document_metadata'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='documentshareduser',
+            index=models.Index(fields=['user', 'document'], name='documents_dsu_user_document'),
+        ),
+        migrations.AddIndex(
+            model_name='foldershareduser',
+            index=models.Index(fields=['user', 'folder'], name='documents_fsu_user_folder'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.0.14 on 2026-10-18 14:24
+
+from django.db import migrations, models
+import pinax.documents.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0010_upload_session'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='document',
+            name='file',
+            field=models.FileField(db_index=True, upload_to=pinax.documents.models.uuid_filename),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.0.14 on 2026-10-18 14:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0012_pending_file_deletion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='trashed',
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='folder',
+            name='trashed',
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.db import migrations
+
+from pinax.documents.utils import collapse_shares
+
+
+def collapse(apps, schema_editor):
+    # only collapse when the project has opted into inherited sharing;
+    # otherwise the per-descendant rows are still what grants access
+    if not getattr(settings, "DOCUMENTS_INHERITED_SHARING", False):
+        return
+    FolderSharedUser = apps.get_model("documents", "FolderSharedUser")
+    DocumentSharedUser = apps.get_model("documents", "DocumentSharedUser")
+    collapse_shares(FolderSharedUser, DocumentSharedUser, schema_editor.connection.alias)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0013_trash'),
+    ]
+
+    operations = [
+        migrations.RunPython(collapse, migrations.RunPython.noop)
+    ]
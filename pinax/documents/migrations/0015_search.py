@@ -0,0 +1,36 @@
+# Generated by Django 3.0.14 on 2026-10-18 15:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+from pinax.documents.search import get_backend
+
+
+def install(apps, schema_editor):
+    get_backend(schema_editor.connection.alias).install(schema_editor)
+
+
+def uninstall(apps, schema_editor):
+    get_backend(schema_editor.connection.alias).uninstall(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0014_collapse_shares'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingIndexUpdate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempts', models.IntegerField(default=0)),
+                ('next_attempt', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True)),
+                ('document', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='documents.Document')),
+            ],
+        ),
+        migrations.RunPython(install, uninstall),
+    ]
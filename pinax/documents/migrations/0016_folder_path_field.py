@@ -0,0 +1,20 @@
+# Generated by Django 3.0.14 on 2026-10-18 15:20
+
+from django.db import migrations
+
+import pinax.documents.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0015_search'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='folder',
+            name='path',
+            field=pinax.documents.fields.PathField(blank=True, db_index=True, default='', editable=False, max_length=255),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.0.14 on 2026-10-18 15:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0016_folder_path_field'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['folder', 'name', 'id'], name='documents_document_listing'),
+        ),
+        migrations.AddIndex(
+            model_name='folder',
+            index=models.Index(fields=['parent', 'name', 'id'], name='documents_folder_listing'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.0.14 on 2026-10-18 16:05
+
+import os
+
+from django.db import migrations, models
+
+
+def forwards(apps, schema_editor):
+    UploadSession = apps.get_model("documents", "UploadSession")
+    for session in UploadSession.objects.filter(chunk_count__gt=0):
+        session.chunks = "".join(
+            os.path.join("uploads", str(session.id), "%08d" % index) + "\n"
+            for index in range(session.chunk_count)
+        )
+        session.save(update_fields=["chunks"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0017_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='chunks',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='uploadsession',
+            name='chunk_count',
+        ),
+    ]
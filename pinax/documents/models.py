@@ -1,22 +1,54 @@
 import itertools
 import math
+import os
+import uuid
 
 from django.contrib.auth import get_user_model
-from django.db import models
-from django.db.models import F
+from django.core.files import File
+from django.core.files.uploadedfile import UploadedFile
+from django.db import models, transaction
+from django.db.models import Count, Exists, F, Max, OuterRef, Q, Sum, Value
+from django.db.models.functions import Coalesce, Concat, Length, Substr
 from django.urls import reverse
 from django.utils import timezone
 
+from . import sharecache
 from .conf import settings
-from .exceptions import DuplicateDocumentNameError, DuplicateFolderNameError
+from .exceptions import (
+    DuplicateDocumentNameError,
+    DuplicateFolderNameError,
+    FolderDepthError,
+    InvalidMoveError,
+    QuotaExceededError,
+    TrashedParentError,
+)
+from .fields import PathField
 from .hooks import hookset
 from .managers import DocumentQuerySet, FolderManager, FolderQuerySet
+from .signals import shares_changed
+from .uploads import ChunkReader, HashingReader
+from .utils import guess_content_type
 
 
 def uuid_filename(instance, filename):
     return hookset.file_upload_to(instance, filename)
 
 
+def check_path_length(length):
+    if length > Folder._meta.get_field("path").max_length:
+        raise FolderDepthError("Folders cannot be nested this deeply.")
+
+
+def child_path(parent_path, pk):
+    """
+    Returns the materialized path of folder `pk` below `parent_path`. Raises
+    FolderDepthError if it does not fit in Folder.path.
+    """
+    path = f"{parent_path}{pk}/"
+    check_path_length(len(path))
+    return path
+
+
 class Folder(models.Model):
 
     name = models.CharField(max_length=140)
@@ -25,9 +57,22 @@ class Folder(models.Model):
     created = models.DateTimeField(default=timezone.now)
     modified = models.DateTimeField(default=timezone.now)
     modified_by = models.ForeignKey(settings.AUTH_USER_MODEL, related_name="+", on_delete=models.CASCADE)
+    # materialized path of ancestor ids including self, e.g. "1/5/9/"
+    path = PathField(max_length=255, blank=True, default="", db_index=True, editable=False)
+    # recursive aggregates of everything below this folder
+    total_bytes = models.BigIntegerField(default=0, editable=False)
+    document_count = models.IntegerField(default=0, editable=False)
+    folder_count = models.IntegerField(default=0, editable=False)
+    trashed = models.DateTimeField(null=True, blank=True, db_index=True, editable=False)
 
     objects = FolderManager.from_queryset(FolderQuerySet)()
 
+    class Meta:
+        indexes = [
+            # folder listings page through children in name order
+            models.Index(fields=["parent", "name", "id"], name="documents_folder_listing"),
+        ]
+
     kind = "folder"
     icon = "folder-open"
     shared = None
@@ -38,7 +83,7 @@ class Folder(models.Model):
 
     @classmethod
     def already_exists(cls, name, parent=None):
-        return cls.objects.filter(name=name, parent=parent).exists()
+        return cls.objects.filter(name=name, parent=parent, trashed__isnull=True).exists()
 
     def __str__(self):
         return self.name
@@ -47,7 +92,165 @@ class Folder(models.Model):
         if not self.pk and Folder.already_exists(self.name, self.parent):
             raise DuplicateFolderNameError(f"{self.name} already exists in this folder.")
         self.touch(self.author, commit=False)
-        super().save(**kwargs)
+        with transaction.atomic():
+            super().save(**kwargs)
+            self.update_path()
+
+    def update_path(self):
+        """
+        Keeps the materialized path of self and its descendants in sync with
+        `parent`. Only touches the database when the parent has changed.
+        """
+        ids = self.ancestor_ids()
+        if self.path and ids[-1:] == ([self.parent_id] if self.parent_id else []):
+            return
+        parent_path = ""
+        if self.parent_id:
+            parent_path = Folder.objects.filter(pk=self.parent_id).values_list("path", flat=True).get()
+        old, self.path = self.path, child_path(parent_path, self.pk)
+        if old:
+            qs = Folder.objects.filter(path__subtree=old)
+            deepest = qs.aggregate(length=Max(Length("path")))["length"]
+            check_path_length(deepest - len(old) + len(self.path))
+            qs.update(path=Concat(Value(self.path), Substr("path", len(old) + 1)))
+        else:
+            Folder.objects.filter(pk=self.pk).update(path=self.path)
+
+    def delete(self, *args, **kwargs):
+        if self.parent_id:
+            totals = Folder.objects.filter(pk=self.pk).values("total_bytes", "document_count", "folder_count").get()
+            self.parent.update_totals(
+                bytes=-totals["total_bytes"],
+                documents=-totals["document_count"],
+                folders=-(totals["folder_count"] + 1),
+            )
+        sharecache.shares_removed(
+            FolderSharedUser.objects.filter(folder__path__subtree=self.path),
+            DocumentSharedUser.objects.filter(document__in=Document.objects.in_subtree(self)),
+        )
+        return super().delete(*args, **kwargs)
+
+    def update_totals(self, bytes=0, documents=0, folders=0):
+        """
+        Applies a delta to the stored aggregates of self and every ancestor
+        in a single UPDATE.
+        """
+        Folder.objects.filter(pk__in=self.ancestor_ids() + [self.pk]).update(
+            total_bytes=F("total_bytes") + bytes,
+            document_count=F("document_count") + documents,
+            folder_count=F("folder_count") + folders,
+        )
+
+    def trash(self):
+        """
+        Moves self and everything below it to the trash with one UPDATE per
+        table. Items trashed earlier keep their own timestamp.
+        """
+        self.trashed = timezone.now()
+        Folder.objects.filter(path__subtree=self.path, trashed__isnull=True).update(trashed=self.trashed)
+        Document.objects.in_subtree(self).filter(trashed__isnull=True).update(trashed=self.trashed)
+
+    def restore(self):
+        """
+        Brings back self and everything that was trashed along with it. No
+        files are copied. Refused while an ancestor is still in the trash.
+        """
+        if Folder.objects.filter(pk__in=self.ancestor_ids(), trashed__isnull=False).exists():
+            raise TrashedParentError(f"Restore the folder containing {self.name} first.")
+        if Folder.already_exists(self.name, self.parent):
+            raise DuplicateFolderNameError(f"{self.name} already exists in this folder.")
+        Folder.objects.filter(path__subtree=self.path, trashed=self.trashed).update(trashed=None)
+        Document.objects.in_subtree(self).filter(trashed=self.trashed).update(trashed=None)
+        self.trashed = None
+
+    def move_to(self, parent, user):
+        """
+        Moves self and everything below it into `parent` (None for the top
+        level). Only rows change: the subtree's paths are rewritten with one
+        UPDATE, totals move from the old ancestors to the new ones, and share
+        rows inherited from the old hierarchy are swapped for those of the
+        new one. No files are touched.
+        """
+        if parent is not None and (parent.pk == self.pk or parent.is_descendant_of(self)):
+            raise InvalidMoveError(f"{self.name} cannot be moved into itself.")
+        if (parent.pk if parent else None) == self.parent_id:
+            return
+        if Folder.already_exists(self.name, parent):
+            raise DuplicateFolderNameError(f"{self.name} already exists in this folder.")
+        old_parent = self.parent
+        with transaction.atomic():
+            totals = Folder.objects.filter(pk=self.pk).values("total_bytes", "document_count", "folder_count").get()
+            delta = (totals["total_bytes"], totals["document_count"], totals["folder_count"] + 1)
+            if old_parent is not None:
+                old_parent.update_totals(*(-n for n in delta))
+            self.parent = parent
+            Folder.objects.filter(pk=self.pk).update(parent=parent)
+            self.update_path()
+            if parent is not None:
+                parent.update_totals(*delta)
+            self.touch(user)
+            if not settings.DOCUMENTS_INHERITED_SHARING:
+                revoked, granted = moved_shares(old_parent, parent)
+                if revoked:
+                    self.unshare(revoked)
+                if granted:
+                    self.share(granted)
+
+    def rename(self, name, user):
+        """
+        Renames self with a single UPDATE.
+        """
+        if name == self.name:
+            return
+        if Folder.already_exists(name, self.parent):
+            raise DuplicateFolderNameError(f"{name} already exists in this folder.")
+        self.name = name
+        Folder.objects.filter(pk=self.pk).update(name=name)
+        self.touch(user)
+
+    def copy_to(self, parent, user):
+        """
+        Copies self and everything below it that `user` can access into
+        `parent` (None for the top level) as folders and documents owned by
+        `user`, and returns the new
+        folder. Rows are cloned with bulk_create and the new documents point
+        at the same stored files, which are only deleted once no document
+        references them. The copy is charged to `user` with a single UPDATE.
+        """
+        if Folder.already_exists(self.name, parent):
+            raise DuplicateFolderNameError(f"{self.name} already exists in this folder.")
+        visible = sorted(
+            Folder.objects.for_user(user).filter(path__subtree=self.path),
+            key=lambda folder: folder.path.count("/"),
+        )
+        # only what `user` can access is copied; a folder hidden from them
+        # leaves out everything below it
+        folders, ids = [], set()
+        for folder in visible:
+            if folder.pk == self.pk or folder.parent_id in ids:
+                folders.append(folder)
+                ids.add(folder.pk)
+        documents = Document.objects.for_user(user).filter(folder__in=ids)
+        usage = documents.order_by().values("folder").annotate(bytes=Coalesce(Sum("file_size"), 0), count=Count("pk"))
+        usage = {row["folder"]: (row["bytes"], row["count"]) for row in usage}
+        total = sum(bytes for bytes, _ in usage.values())
+        if not user.storage.reserve(total):
+            raise QuotaExceededError("The copy will exceed storage capacity.")
+        try:
+            with transaction.atomic():
+                copies = clone_folders(folders, parent, user, usage)
+                clone_documents(documents, copies, user)
+                copy = copies[self.pk]
+                PendingIndexUpdate.enqueue(Document.objects.in_subtree(copy).values_list("pk", flat=True))
+                if parent is not None:
+                    parent.update_totals(copy.total_bytes, copy.document_count, copy.folder_count + 1)
+                    parent.touch(user)
+                    if not settings.DOCUMENTS_INHERITED_SHARING:
+                        copy.share(parent.shared_parent().shared_with())
+        except Exception:
+            user.storage.release(total)
+            raise
+        return copy
 
     def get_absolute_url(self):
         return reverse("pinax_documents:folder_detail", args=[self.pk])
@@ -59,37 +262,60 @@ class Folder(models.Model):
         return Folder.objects.members(self, **kwargs)
 
     def touch(self, user, commit=True):
+        """
+        Marks self and every ancestor as modified by `user`, in a single
+        UPDATE when `commit` is set.
+        """
         self.modified = timezone.now()
         self.modified_by = user
         if commit:
-            if self.parent:
-                self.parent.touch(user)
-            self.save()
+            Folder.objects.filter(pk__in=self.ancestor_ids() + [self.pk]).touch(user, self.modified)
 
     @property
     def size(self):
         """
         Return size of this folder.
         """
-        return sum([m.size for m in self.members(direct=False) if m.kind == "document"])
+        return self.total_bytes
+
+    def ancestor_ids(self):
+        """
+        Returns ids of all ancestors (excluding self), root first.
+        """
+        return [int(pk) for pk in self.path.split("/") if pk][:-1]
+
+    def ancestors(self, include_self=False):
+        """
+        Returns a queryset of ancestors, fetched in a single query.
+        """
+        ids = self.ancestor_ids()
+        if include_self:
+            ids.append(self.pk)
+        return Folder.objects.filter(pk__in=ids)
+
+    def is_descendant_of(self, folder):
+        """
+        Returns True if self lives (at any depth) below `folder`.
+        """
+        return self.pk != folder.pk and self.path.startswith(folder.path)
 
     def breadcrumbs(self):
         """
         Produces a list of ancestors (excluding self).
         """
-        crumbs = []
-        if self.parent:
-            crumbs.extend(self.parent.breadcrumbs())
-            crumbs.append(self.parent)
-        return crumbs
+        ids = self.ancestor_ids()
+        return sorted(self.ancestors(), key=lambda folder: ids.index(folder.pk))
 
     def shared_queryset(self):
         """
         Returns queryset of this folder mapped into the shared user model.
         The queryset should only consist of zero or one instances (aka shared
-        or not shared.) This method is mostly used for convenience.
+        or not shared.) This method is mostly used for convenience. With
+        inherited sharing, grants on ancestors are included.
         """
         model = self.shared_user_model()
+        if settings.DOCUMENTS_INHERITED_SHARING:
+            return model._default_manager.filter(folder__in=self.ancestor_ids() + [self.pk])
         return model._default_manager.filter(**{model.obj_attr: self})
 
     @property
@@ -114,6 +340,9 @@ class Folder(models.Model):
         User = get_user_model()
         qs = self.shared_queryset()
         if user is not None:
+            if settings.DOCUMENTS_SHARE_CACHE:
+                ids = self.ancestor_ids() if settings.DOCUMENTS_INHERITED_SHARING else []
+                return any(sharecache.is_shared(Folder, user, pk) for pk in ids + [self.pk])
             return qs.filter(user=user).exists()
         if not qs.exists():
             return User.objects.none()
@@ -124,13 +353,19 @@ class Folder(models.Model):
         Returns the folder object that is the shared parent (the root of
         a shared folder hierarchy) or None if there is no shared parent.
         """
+        model = self.shared_user_model()
+        shared = model._default_manager.filter(**{model.obj_attr: OuterRef("pk")})
+        crumbs = self.ancestors().annotate(is_shared=Exists(shared)).in_bulk()
+        if settings.DOCUMENTS_INHERITED_SHARING:
+            # only the root of a shared hierarchy holds grants
+            return next((crumbs[pk] for pk in self.ancestor_ids() if crumbs[pk].is_shared), self)
         root = self
-        a, b = itertools.tee(reversed(self.breadcrumbs()))
+        a, b = itertools.tee(crumbs[pk] for pk in reversed(self.ancestor_ids()))
         next(b, None)
         for folder, parent in itertools.zip_longest(a, b):
-            if folder.shared:
+            if folder.is_shared:
                 root = folder
-            if parent is None or not parent.shared:
+            if parent is None or not parent.is_shared:
                 break
         return root
 
@@ -143,22 +378,40 @@ class Folder(models.Model):
     def share(self, users):
         """
         Ensures self is shared with given users (can accept users who are
-        already shared on self).
-        """
-        users = [u for u in users if not self.shared_with(user=u)]
-        if users:
-            members = [self] + self.members(direct=False)
-            FM, DM = self.shared_user_model(), Document.shared_user_model()
-            fm, dm = [], []
-            for member, user in itertools.product(members, users):
-                if user.pk == member.author_id:
-                    continue
-                if isinstance(member, Folder):
-                    fm.append(FM(**{FM.obj_attr: member, "user": user}))
-                if isinstance(member, Document):
-                    dm.append(DM(**{DM.obj_attr: member, "user": user}))
-            FM._default_manager.bulk_create(fm)
-            DM._default_manager.bulk_create(dm)
+        already shared on self). Returns the number of share rows created.
+        """
+        FM, DM = self.shared_user_model(), Document.shared_user_model()
+        users = [u.pk for u in users]
+        existing = FM._default_manager.filter(folder=self, user__in=users).values_list("user", flat=True)
+        existing = set(existing)
+        users = [pk for pk in users if pk not in existing]
+        if not users:
+            return 0
+        if settings.DOCUMENTS_INHERITED_SHARING:
+            # descendants inherit the grant through their path
+            return FM.grant(Folder.objects.filter(pk=self.pk), users)
+        folders = Folder.objects.filter(path__subtree=self.path)
+        documents = Document.objects.in_subtree(self)
+        return FM.grant(folders, users) + DM.grant(documents, users)
+
+    def unshare(self, users):
+        """
+        Revokes the access of `users` to self and everything below it with
+        one DELETE per share table. Returns the number of share rows deleted.
+        """
+        FM, DM = self.shared_user_model(), Document.shared_user_model()
+        users = [u.pk for u in users]
+        folders = FM._default_manager.filter(folder__path__subtree=self.path, user__in=users)
+        documents = DM._default_manager.filter(document__folder__path__subtree=self.path, user__in=users)
+        count = folders.delete()[0] + documents.delete()[0]
+        shares_changed.send(sender=FM, user_ids=users)
+        return count
+
+    def download_url(self):
+        return reverse(
+            "pinax_documents:folder_download",
+            args=[self.pk]
+        )
 
     def delete_url(self):
         return reverse(
@@ -175,20 +428,32 @@ class Document(models.Model):
     created = models.DateTimeField(default=timezone.now)
     modified = models.DateTimeField(default=timezone.now)
     modified_by = models.ForeignKey(settings.AUTH_USER_MODEL, related_name="+", on_delete=models.CASCADE)
-    file = models.FileField(upload_to=uuid_filename)
+    file = models.FileField(upload_to=uuid_filename, db_index=True)
     original_filename = models.CharField(max_length=500)
+    file_size = models.BigIntegerField(null=True, blank=True, db_index=True, editable=False)
+    content_type = models.CharField(max_length=255, blank=True, db_index=True, editable=False)
+    checksum = models.CharField(max_length=64, blank=True, db_index=True, editable=False)
+    trashed = models.DateTimeField(null=True, blank=True, db_index=True, editable=False)
 
     objects = DocumentQuerySet.as_manager()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["folder", "name", "id"], name="documents_document_listing"),
+        ]
+
     kind = "document"
     icon = "file"
     shared = None
 
     def delete(self, *args, **kwargs):
         bytes_to_free = self.size
+        sharecache.shares_removed(DocumentSharedUser.objects.filter(document=self))
         super().delete(*args, **kwargs)
         storage_qs = UserStorage.objects.filter(pk=self.author.storage.pk)
         storage_qs.update(bytes_used=F("bytes_used") - bytes_to_free)
+        if self.folder_id:
+            self.folder.update_totals(bytes=-bytes_to_free, documents=-1)
 
     @classmethod
     def shared_user_model(cls):
@@ -196,7 +461,25 @@ class Document(models.Model):
 
     @classmethod
     def already_exists(cls, name, folder=None):
-        return cls.objects.filter(name=name, folder=folder).exists()
+        return cls.objects.filter(name=name, folder=folder, trashed__isnull=True).exists()
+
+    @classmethod
+    def store_blob(cls, upload, checksum):
+        """
+        Stores `upload` once under its content digest and returns the stored
+        name. If a blob with the same digest exists, nothing is written.
+        """
+        storage = cls._meta.get_field("file").storage
+        name = hookset.blob_upload_to(checksum, upload.name)
+        if storage.exists(name):
+            return name
+        return storage.save(name, upload)
+
+    def file_referenced_elsewhere(self):
+        """
+        Returns True if another document shares this document's stored file.
+        """
+        return Document.objects.filter(file=self.file.name).exclude(pk=self.pk).exists()
 
     def __str__(self):
         return self.name
@@ -204,9 +487,66 @@ class Document(models.Model):
     def save(self, **kwargs):
         if not self.pk and Document.already_exists(self.name, self.folder):
             raise DuplicateDocumentNameError(f"{self.name} already exists in this folder.")
+        if self.file_size is None and self.file:
+            self.file_size = self.file.size
         self.touch(self.author, commit=False)
         super().save(**kwargs)
 
+    def trash(self):
+        self.trashed = timezone.now()
+        Document.objects.filter(pk=self.pk).update(trashed=self.trashed)
+
+    def restore(self):
+        """
+        Brings self back. Refused while its folder is still in the trash.
+        """
+        if self.folder_id and self.folder.ancestors(include_self=True).filter(trashed__isnull=False).exists():
+            raise TrashedParentError(f"Restore the folder containing {self.name} first.")
+        if Document.already_exists(self.name, self.folder):
+            raise DuplicateDocumentNameError(f"{self.name} already exists in this folder.")
+        Document.objects.filter(pk=self.pk).update(trashed=None)
+        self.trashed = None
+
+    def move_to(self, folder, user):
+        """
+        Moves self into `folder` (None for the top level) by updating its
+        foreign key. The stored file stays where it is.
+        """
+        if (folder.pk if folder else None) == self.folder_id:
+            return
+        if Document.already_exists(self.name, folder):
+            raise DuplicateDocumentNameError(f"{self.name} already exists in this folder.")
+        old_folder = self.folder
+        with transaction.atomic():
+            if old_folder is not None:
+                old_folder.update_totals(bytes=-self.size, documents=-1)
+            self.folder = folder
+            Document.objects.filter(pk=self.pk).update(folder=folder)
+            if folder is not None:
+                folder.update_totals(bytes=self.size, documents=1)
+            self.touch(user)
+            if not settings.DOCUMENTS_INHERITED_SHARING:
+                revoked, granted = moved_shares(old_folder, folder)
+                if revoked:
+                    self.unshare(revoked)
+                if granted:
+                    self.share(granted)
+
+    def rename(self, name, user):
+        """
+        Renames self with a single UPDATE; the stored file keeps its name.
+        """
+        if name == self.name:
+            return
+        if Document.already_exists(name, self.folder):
+            raise DuplicateDocumentNameError(f"{name} already exists in this folder.")
+        self.name = name
+        self.touch(user, commit=False)
+        Document.objects.filter(pk=self.pk).update(name=name, modified=self.modified, modified_by=user)
+        if self.folder_id:
+            self.folder.touch(user)
+        PendingIndexUpdate.enqueue([self.pk])
+
     def get_absolute_url(self):
         return reverse("pinax_documents:document_detail", args=[self.pk])
 
@@ -217,20 +557,21 @@ class Document(models.Model):
         self.modified = timezone.now()
         self.modified_by = user
         if commit:
-            if self.folder:
+            Document.objects.filter(pk=self.pk).update(modified=self.modified, modified_by=user)
+            if self.folder_id:
                 self.folder.touch(user)
-            self.save()
 
     @property
     def size(self):
-        return self.file.size
+        if self.file_size is None:
+            return self.file.size
+        return self.file_size
 
     def breadcrumbs(self):
-        crumbs = []
-        if self.folder:
-            crumbs.extend(self.folder.breadcrumbs())
-            crumbs.append(self.folder)
-        return crumbs
+        if self.folder is None:
+            return []
+        ids = self.folder.ancestor_ids() + [self.folder_id]
+        return sorted(self.folder.ancestors(include_self=True), key=lambda folder: ids.index(folder.pk))
 
     def shared_queryset(self):
         """
@@ -247,6 +588,8 @@ class Document(models.Model):
         Determines if self is shared. This checks the denormalization and
         does not return whether self SHOULD be shared (based on parents.)
         """
+        if self.folder_id and settings.DOCUMENTS_INHERITED_SHARING and self.folder.shared:
+            return True
         return self.shared_queryset().exists()
 
     def shared_ui(self):
@@ -260,19 +603,29 @@ class Document(models.Model):
         User = get_user_model()
         qs = self.shared_queryset()
         if user is not None:
+            if self.folder_id and settings.DOCUMENTS_INHERITED_SHARING and self.folder.shared_with(user):
+                return True
+            if settings.DOCUMENTS_SHARE_CACHE:
+                return sharecache.is_shared(type(self), user, self.pk)
             return qs.filter(user=user).exists()
+        if self.folder_id and settings.DOCUMENTS_INHERITED_SHARING:
+            inherited = self.folder.shared_queryset()
+            return User.objects.filter(Q(pk__in=qs.values("user")) | Q(pk__in=inherited.values("user")))
         if not qs.exists():
             return User.objects.none()
         return User.objects.filter(pk__in=qs.values("user"))
 
     def share(self, users):
-        users = [u for u in users if not self.shared_with(user=u)]
-        if users:
-            model = self.shared_user_model()
-            objs = []
-            for user in users:
-                objs.append(self.shared_user_model()(**{model.obj_attr: self, "user": user}))
-            model._default_manager.bulk_create(objs)
+        model = self.shared_user_model()
+        users = [u.pk for u in users]
+        return model.grant(Document.objects.filter(pk=self.pk), users, skip_authors=False)
+
+    def unshare(self, users):
+        model = self.shared_user_model()
+        users = [u.pk for u in users]
+        count = model._default_manager.filter(document=self, user__in=users).delete()[0]
+        shares_changed.send(sender=model, user_ids=users)
+        return count
 
     def download_url(self):
         return reverse(
@@ -287,6 +640,88 @@ class Document(models.Model):
         )
 
 
+def moved_shares(source, destination):
+    """
+    Returns the users whose inherited access is lost and gained when an item
+    moves from the `source` folder to `destination` (either may be None).
+    """
+    def users(folder):
+        if folder is None:
+            return {}
+        return {user.pk: user for user in folder.shared_parent().shared_with()}
+
+    before, after = users(source), users(destination)
+    revoked = [user for pk, user in before.items() if pk not in after]
+    granted = [user for pk, user in after.items() if pk not in before]
+    return revoked, granted
+
+
+def clone_folders(folders, parent, user, usage):
+    """
+    Creates copies of `folders` (sorted by depth, the first being copied into
+    `parent`) level by level, with totals computed from `usage`, the
+    (bytes, documents) held directly by each source folder. Returns a dict
+    mapping source folder ids to their copies.
+    """
+    totals = {folder.pk: [0, 0, 0] for folder in folders}
+    for folder in folders:
+        bytes, count = usage.get(folder.pk, (0, 0))
+        ancestors = [pk for pk in folder.ancestor_ids() if pk in totals]
+        for pk in ancestors + [folder.pk]:
+            totals[pk][0] += bytes
+            totals[pk][1] += count
+        for pk in ancestors:
+            totals[pk][2] += 1
+    copies, now = {}, timezone.now()
+    for _, level in itertools.groupby(folders, lambda folder: folder.path.count("/")):
+        level = [(folder, copies.get(folder.parent_id, parent)) for folder in level]
+        Folder.objects.bulk_create(
+            [
+                Folder(
+                    name=folder.name,
+                    parent=target,
+                    author=user,
+                    modified_by=user,
+                    created=now,
+                    modified=now,
+                    total_bytes=totals[folder.pk][0],
+                    document_count=totals[folder.pk][1],
+                    folder_count=totals[folder.pk][2],
+                )
+                for folder, target in level
+            ],
+            batch_size=settings.DOCUMENTS_COPY_BATCH_SIZE,
+        )
+        # bulk_create does not set primary keys on every backend; rows of
+        # this level are the only ones without a path inside the transaction
+        created = Folder.objects.filter(path="", author=user, created=now)
+        created = {(folder.parent_id, folder.name): folder for folder in created}
+        for folder, target in level:
+            copy = copies[folder.pk] = created[(getattr(target, "pk", None), folder.name)]
+            copy.path = child_path(target.path if target else "", copy.pk)
+        Folder.objects.bulk_update(created.values(), ["path"], batch_size=settings.DOCUMENTS_COPY_BATCH_SIZE)
+    return copies
+
+
+def clone_documents(documents, copies, user):
+    """
+    Creates a copy of each of `documents` in the copy of its folder, pointing
+    at the same stored file, in batches of DOCUMENTS_COPY_BATCH_SIZE.
+    """
+    batch_size = settings.DOCUMENTS_COPY_BATCH_SIZE
+    now = timezone.now()
+    fields = ["name", "folder", "file", "original_filename", "file_size", "content_type", "checksum"]
+    rows = (
+        Document(author=user, modified_by=user, created=now, modified=now, **dict(row, folder=copies[row["folder"]]))
+        for row in documents.values(*fields).iterator(chunk_size=batch_size)
+    )
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        Document.objects.bulk_create(batch)
+
+
 class MemberSharedUser(models.Model):
 
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -300,6 +735,38 @@ class MemberSharedUser(models.Model):
         qs = cls._default_manager.filter(user=user)
         return qs.values_list(cls.obj_attr, flat=True)
 
+    @classmethod
+    def grant(cls, members, user_ids, skip_authors=True):
+        """
+        Shares every object in the `members` queryset with each of `user_ids`.
+        Members are streamed in batches of DOCUMENTS_SHARE_BATCH_SIZE; pairs
+        already granted in a batch are looked up by the (object, user) index
+        and skipped. Returns the number of rows inserted.
+        """
+        batch_size = settings.DOCUMENTS_SHARE_BATCH_SIZE
+        manager = cls._default_manager
+        obj_id = f"{cls.obj_attr}_id"
+        members = members.values_list("pk", "author_id").iterator(chunk_size=batch_size)
+        inserted = 0
+        while True:
+            batch = list(itertools.islice(members, batch_size))
+            if not batch:
+                break
+            existing = set(manager.filter(
+                **{f"{obj_id}__in": [pk for pk, author_id in batch]}, user__in=user_ids
+            ).values_list(obj_id, "user_id"))
+            rows = [
+                cls(**{obj_id: pk, "user_id": user_id})
+                for pk, author_id in batch
+                for user_id in user_ids
+                if (pk, user_id) not in existing and not (skip_authors and user_id == author_id)
+            ]
+            # conflicts only arise from a concurrent grant of the same pairs
+            manager.bulk_create(rows, batch_size=batch_size, ignore_conflicts=True)
+            inserted += len(rows)
+        shares_changed.send(sender=cls, user_ids=user_ids)
+        return inserted
+
 
 class FolderSharedUser(MemberSharedUser):
 
@@ -308,6 +775,9 @@ class FolderSharedUser(MemberSharedUser):
 
     class Meta:
         unique_together = [("folder", "user")]
+        indexes = [
+            models.Index(fields=["user", "folder"], name="documents_fsu_user_folder"),
+        ]
 
 
 class DocumentSharedUser(MemberSharedUser):
@@ -317,6 +787,9 @@ class DocumentSharedUser(MemberSharedUser):
 
     class Meta:
         unique_together = [("document", "user")]
+        indexes = [
+            models.Index(fields=["user", "document"], name="documents_dsu_user_document"),
+        ]
 
 
 class UserStorage(models.Model):
@@ -332,3 +805,157 @@ class UserStorage(models.Model):
     @property
     def color(self):
         return hookset.storage_color(self)
+
+    def reserve(self, bytes):
+        """
+        Atomically adds `bytes` to `bytes_used` if that keeps usage within
+        `bytes_total`. Returns True on success.
+        """
+        qs = UserStorage.objects.filter(pk=self.pk, bytes_used__lte=F("bytes_total") - bytes)
+        return qs.update(bytes_used=F("bytes_used") + bytes) == 1
+
+    def release(self, bytes):
+        """
+        Gives back `bytes` previously taken with `reserve()`.
+        """
+        UserStorage.objects.filter(pk=self.pk).update(bytes_used=F("bytes_used") - bytes)
+
+
+class UploadSession(models.Model):
+    """
+    A resumable upload in progress. Chunks are written straight to storage
+    and assembled into a Document on commit; the quota for the full size is
+    reserved when the session is created.
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name="+", on_delete=models.CASCADE)
+    folder = models.ForeignKey(Folder, null=True, blank=True, on_delete=models.CASCADE)
+    name = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    # stored names of the appended chunks, one per line, in order
+    chunks = models.TextField(blank=True, default="")
+    created = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def complete(self):
+        return self.offset == self.size
+
+    @property
+    def storage(self):
+        return Document._meta.get_field("file").storage
+
+    def chunk_name(self, offset):
+        # unique per attempt, so a retry never touches a chunk that an
+        # earlier request for the same offset may still commit
+        return os.path.join("uploads", str(self.id), "%016d-%s" % (offset, uuid.uuid4().hex))
+
+    def chunk_names(self):
+        return self.chunks.splitlines()
+
+    def get_absolute_url(self):
+        return reverse("pinax_documents:document_upload_detail", args=[self.pk])
+
+    def append(self, stream, offset, length):
+        """
+        Writes `length` bytes read from `stream` as the next chunk if `offset`
+        matches the current offset. Returns False when it does not (for
+        example after a concurrent append), or when fewer than `length` bytes
+        could be read from `stream`.
+        """
+        if length <= 0 or offset != self.offset or self.offset + length > self.size:
+            return False
+        name = self.chunk_name(offset)
+        chunk = File(stream, name=name)
+        chunk.size = length
+        name = self.storage.save(name, chunk)
+        if self.storage.size(name) != length:
+            # truncated request body
+            self.storage.delete(name)
+            return False
+        qs = UploadSession.objects.filter(pk=self.pk, offset=offset)
+        if not qs.update(offset=F("offset") + length, chunks=Concat("chunks", Value(name + "\n"))):
+            # another request appended at this offset first
+            self.storage.delete(name)
+            return False
+        self.offset += length
+        self.chunks += name + "\n"
+        return True
+
+    def store(self):
+        """
+        Writes the assembled upload to a new document file, reading each chunk
+        once, and returns the stored name along with its checksum.
+        """
+        reader = HashingReader(ChunkReader(self.storage, self.chunk_names()))
+        name = Document._meta.get_field("file").generate_filename(None, self.name)
+        name = self.storage.save(name, File(reader, name=self.name))
+        return name, reader.hexdigest()
+
+    def open(self):
+        """
+        Returns the assembled upload as an UploadedFile that streams its chunks.
+        """
+        return UploadedFile(
+            file=ChunkReader(self.storage, self.chunk_names()),
+            name=self.name,
+            content_type=guess_content_type(self.name),
+            size=self.size,
+        )
+
+    def delete(self, *args, **kwargs):
+        """
+        Deletes the stored chunks and, unless the upload was committed,
+        gives back the reserved quota.
+        """
+        for name in self.chunk_names():
+            self.storage.delete(name)
+        if not kwargs.pop("committed", False):
+            UserStorage.objects.filter(user=self.user_id).update(bytes_used=F("bytes_used") - self.size)
+        return super().delete(*args, **kwargs)
+
+
+class PendingFileDeletion(models.Model):
+    """
+    A stored file queued for removal by the `process_file_deletions` worker.
+    """
+
+    name = models.CharField(max_length=255)
+    attempts = models.IntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now, db_index=True)
+    last_error = models.TextField(blank=True)
+
+    def __str__(self):
+        return self.name
+
+
+class PendingIndexUpdate(models.Model):
+    """
+    A document whose name and text are waiting for the `process_search_index`
+    worker to (re)index them.
+    """
+
+    document = models.OneToOneField(Document, related_name="+", on_delete=models.CASCADE)
+    attempts = models.IntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now, db_index=True)
+    last_error = models.TextField(blank=True)
+
+    def __str__(self):
+        return str(self.document_id)
+
+    @classmethod
+    def enqueue(cls, document_ids):
+        """
+        Queues documents for indexing in batches; queued ones are skipped.
+        """
+        batch_size = settings.DOCUMENTS_SEARCH_BATCH_SIZE
+        rows = (cls(document_id=pk) for pk in document_ids)
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            cls.objects.bulk_create(batch, ignore_conflicts=True)
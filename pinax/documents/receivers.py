@@ -1,8 +1,12 @@
+from django.db import transaction
 from django.db.models.signals import post_save, pre_delete
 from django.dispatch import receiver
 
+from . import sharecache
 from .conf import settings
-from .models import Document, UserStorage
+from .indexing import remove_from_index
+from .models import Document, PendingIndexUpdate, UserStorage
+from .signals import shares_changed
 
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
@@ -12,8 +16,31 @@ def ensure_userstorage(sender, **kwargs):
         UserStorage.objects.create(user=user, bytes_total=(1024 * 1024 * 50))
 
 
-# Receive the pre_delete signal and delete the file associated with the model instance.
+# Receive the pre_delete signal and delete the file associated with the model instance,
+# unless other documents still reference it.
 @receiver(pre_delete, sender=Document)
 def document_delete(sender, instance, **kwargs):
+    if instance.file_referenced_elsewhere():
+        return
     # Pass false so FileField doesn't save the model.
     instance.file.delete(False)
+
+
+@receiver(post_save, sender=Document)
+def queue_document_index(sender, instance, created, **kwargs):
+    if created:
+        PendingIndexUpdate.enqueue([instance.pk])
+
+
+@receiver(pre_delete, sender=Document)
+def remove_document_index(sender, instance, **kwargs):
+    remove_from_index(Document.objects.filter(pk=instance.pk))
+
+
+@receiver(shares_changed)
+def invalidate_share_cache(sender, user_ids, **kwargs):
+    # after commit, or a concurrent request could cache the old shares
+    # again before the change is visible to it
+    if settings.DOCUMENTS_SHARE_CACHE:
+        user_ids = set(user_ids)
+        transaction.on_commit(lambda: sharecache.invalidate(user_ids))
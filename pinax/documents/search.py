@@ -0,0 +1,196 @@
+import re
+
+from django.core.exceptions import EmptyResultSet
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+
+from .conf import load_path_attr, settings
+from .utils import SubquerySQL
+
+# full-text index of document names and contents, keyed by document id
+TABLE = "documents_search"
+MAX_TERMS = 16
+
+
+def terms(query):
+    """
+    Splits a user's search query into words, ignoring any query syntax.
+    """
+    return re.findall(r"\w+", query)[:MAX_TERMS]
+
+
+class SearchBackend:
+    """
+    Base class for the backends selected by DOCUMENTS_SEARCH_BACKEND.
+    """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.using = using
+
+    def install(self, schema_editor):
+        """
+        Creates the index; called by the app's migrations.
+        """
+
+    def uninstall(self, schema_editor):
+        pass
+
+    def index(self, document, text):
+        """
+        Stores `document`'s name and extracted `text`, replacing any earlier entry.
+        """
+        raise NotImplementedError()
+
+    def remove(self, documents):
+        """
+        Drops the entries of the `documents` queryset.
+        """
+        raise NotImplementedError()
+
+    def search(self, queryset, query):
+        """
+        Narrows the document `queryset` to matches for `query`, best first.
+        """
+        raise NotImplementedError()
+
+    def execute(self, sql, params=None):
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(sql, params)
+
+    def subquery(self, documents):
+        """
+        Returns the SQL selecting the pks of `documents`, or None if the
+        queryset can't match anything.
+        """
+        query = documents.order_by().values("pk").query
+        try:
+            sql, params = query.get_compiler(self.using).as_sql()
+        except EmptyResultSet:
+            return None, []
+        return f"({sql})", params
+
+    def outer_pk(self, queryset):
+        qn = connections[self.using].ops.quote_name
+        return f"{qn(queryset.model._meta.db_table)}.{qn(queryset.model._meta.pk.column)}"
+
+
+class SQLiteBackend(SearchBackend):
+    """
+    An FTS5 table whose rowid is the document id. Terms are matched as
+    prefixes and results ranked with bm25, names weighing more than contents.
+    """
+
+    def install(self, schema_editor):
+        schema_editor.execute(f"CREATE VIRTUAL TABLE {TABLE} USING fts5(name, content)")
+
+    def uninstall(self, schema_editor):
+        schema_editor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+    def index(self, document, text):
+        with transaction.atomic(using=self.using):
+            self.execute(f"DELETE FROM {TABLE} WHERE rowid = %s", [document.pk])
+            self.execute(
+                f"INSERT INTO {TABLE} (rowid, name, content) VALUES (%s, %s, %s)",
+                [document.pk, document.name, text],
+            )
+
+    def remove(self, documents):
+        sql, params = self.subquery(documents)
+        if sql is not None:
+            self.execute(f"DELETE FROM {TABLE} WHERE rowid IN {sql}", params)
+
+    def search(self, queryset, query):
+        words = terms(query)
+        if not words:
+            return queryset.none()
+        match = " ".join('"{}"*'.format(word.replace('"', '""')) for word in words)
+        matches = SubquerySQL(f"SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s", [match])
+        rank = RawSQL(
+            f"SELECT bm25({TABLE}, 10.0, 1.0) FROM {TABLE} WHERE {TABLE} MATCH %s AND rowid = {self.outer_pk(queryset)}",
+            [match],
+            output_field=FloatField(),
+        )
+        # bm25 scores are negative; lower is better
+        return queryset.filter(pk__in=matches).annotate(search_rank=rank).order_by("search_rank", "pk")
+
+
+class PostgresBackend(SearchBackend):
+    """
+    A tsvector per document in a GIN-indexed table, built with the
+    DOCUMENTS_SEARCH_CONFIG text search configuration. Terms are matched as
+    prefixes and results ranked with ts_rank, names weighing more than
+    contents.
+    """
+
+    def install(self, schema_editor):
+        schema_editor.execute(f"CREATE TABLE {TABLE} (document_id integer PRIMARY KEY, vector tsvector NOT NULL)")
+        schema_editor.execute(f"CREATE INDEX {TABLE}_vector ON {TABLE} USING gin (vector)")
+
+    def uninstall(self, schema_editor):
+        schema_editor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+    def index(self, document, text):
+        config = settings.DOCUMENTS_SEARCH_CONFIG
+        self.execute(
+            f"INSERT INTO {TABLE} (document_id, vector) VALUES (%s, "
+            "setweight(to_tsvector(%s::regconfig, %s), 'A') || setweight(to_tsvector(%s::regconfig, %s), 'B')) "
+            "ON CONFLICT (document_id) DO UPDATE SET vector = EXCLUDED.vector",
+            [document.pk, config, document.name, config, text],
+        )
+
+    def remove(self, documents):
+        sql, params = self.subquery(documents)
+        if sql is not None:
+            self.execute(f"DELETE FROM {TABLE} WHERE document_id IN {sql}", params)
+
+    def search(self, queryset, query):
+        words = terms(query)
+        if not words:
+            return queryset.none()
+        params = [settings.DOCUMENTS_SEARCH_CONFIG, " & ".join(f"{word}:*" for word in words)]
+        matches = SubquerySQL(f"SELECT document_id FROM {TABLE} WHERE vector @@ to_tsquery(%s::regconfig, %s)", params)
+        rank = RawSQL(
+            f"SELECT ts_rank(vector, to_tsquery(%s::regconfig, %s)) FROM {TABLE} "
+            f"WHERE document_id = {self.outer_pk(queryset)}",
+            params,
+            output_field=FloatField(),
+        )
+        return queryset.filter(pk__in=matches).annotate(search_rank=rank).order_by("-search_rank", "pk")
+
+
+class NameBackend(SearchBackend):
+    """
+    Matches document names only, for databases without a full-text backend.
+    """
+
+    def index(self, document, text):
+        pass
+
+    def remove(self, documents):
+        pass
+
+    def search(self, queryset, query):
+        words = terms(query)
+        if not words:
+            return queryset.none()
+        for word in words:
+            queryset = queryset.filter(name__icontains=word)
+        return queryset.order_by("name", "pk")
+
+
+BACKENDS = {
+    "sqlite": SQLiteBackend,
+    "postgresql": PostgresBackend,
+}
+
+
+def get_backend(using=DEFAULT_DB_ALIAS):
+    """
+    Returns the search backend selected by DOCUMENTS_SEARCH_BACKEND, or the
+    built-in one for the database's vendor.
+    """
+    path = settings.DOCUMENTS_SEARCH_BACKEND
+    if path is None:
+        return BACKENDS.get(connections[using].vendor, NameBackend)(using)
+    return load_path_attr(path)(using)
@@ -0,0 +1,106 @@
+"""
+Per-user cache of the folder and document ids shared with each user, used
+for point checks such as `shared_with(user=...)` and the access checks of
+the detail and download views when DOCUMENTS_SHARE_CACHE is enabled.
+Querysets (`for_user()`) keep using the indexed subquery. Ids are kept as
+a sorted array of integers so membership checks are a binary search and
+entries stay small.
+"""
+import array
+import bisect
+
+from django.core.cache import caches
+
+from .conf import settings
+from .signals import shares_changed
+
+KEY_PREFIX = "pinax-documents:shares"
+STATS_KEYS = {"hits": f"{KEY_PREFIX}:hits", "misses": f"{KEY_PREFIX}:misses"}
+
+
+def get_cache():
+    return caches[settings.DOCUMENTS_SHARE_CACHE_ALIAS]
+
+
+def cache_key(model, user_id):
+    return f"{KEY_PREFIX}:{model._meta.model_name}:{user_id}"
+
+
+def pack(ids):
+    typecode = "Q" if ids and ids[-1] >= 2 ** 32 else "I"
+    return typecode, array.array(typecode, ids).tobytes()
+
+
+def unpack(value):
+    typecode, data = value
+    ids = array.array(typecode)
+    ids.frombytes(data)
+    return ids
+
+
+def incr(name):
+    cache = get_cache()
+    try:
+        cache.incr(STATS_KEYS[name])
+    except ValueError:
+        cache.add(STATS_KEYS[name], 0, timeout=None)
+        cache.incr(STATS_KEYS[name])
+
+
+def shared_ids(model, user):
+    """
+    Returns the sorted ids of `model` rows shared with `user`, loading them
+    into the cache on a miss.
+    """
+    cache = get_cache()
+    key = cache_key(model, user.pk)
+    value = cache.get(key)
+    if value is not None:
+        incr("hits")
+        return unpack(value)
+    incr("misses")
+    shared_user_model = model.shared_user_model()
+    value = pack(sorted(shared_user_model.for_user(user)))
+    cache.set(key, value, settings.DOCUMENTS_SHARE_CACHE_TIMEOUT)
+    return unpack(value)
+
+
+def is_shared(model, user, pk):
+    ids = shared_ids(model, user)
+    i = bisect.bisect_left(ids, pk)
+    return i < len(ids) and ids[i] == pk
+
+
+def invalidate(user_ids):
+    """
+    Drops the cached folder and document ids of `user_ids`.
+    """
+    from .models import Document, Folder
+    keys = [cache_key(model, user_id) for model in (Folder, Document) for user_id in user_ids]
+    get_cache().delete_many(keys)
+
+
+def shares_removed(*querysets):
+    """
+    Announces that the share rows in `querysets` are about to be deleted.
+    Only queries for the affected users when the cache is enabled.
+    """
+    if not settings.DOCUMENTS_SHARE_CACHE:
+        return
+    user_ids = set()
+    for qs in querysets:
+        user_ids.update(qs.order_by().values_list("user", flat=True).distinct())
+    if user_ids:
+        shares_changed.send(sender=None, user_ids=user_ids)
+
+
+def stats():
+    """
+    Returns the hit and miss counters, shared by every process using the cache.
+    """
+    values = get_cache().get_many(STATS_KEYS.values())
+    return {name: values.get(key, 0) for name, key in STATS_KEYS.items()}
+
+
+def reset_stats():
+    get_cache().delete_many(STATS_KEYS.values())
@@ -0,0 +1,4 @@
+from django.dispatch import Signal
+
+# sent with `user_ids` whenever the objects shared with those users change
+shares_changed = Signal()
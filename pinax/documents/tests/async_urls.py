@@ -0,0 +1,5 @@
+from django.conf.urls import include, url
+
+urlpatterns = [
+    url(r"^docs/", include("pinax.documents.async_urls", namespace="pinax_documents")),
+]
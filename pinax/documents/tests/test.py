@@ -1,9 +1,40 @@
+import threading
+import zipfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import F
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
 from test_plus.test import TestCase as PlusTestCase
 
-from ..exceptions import DuplicateDocumentNameError, DuplicateFolderNameError
-from ..models import Document, Folder
+from .. import sharecache
+from ..deletion import delete_documents
+from ..exceptions import (
+    DuplicateDocumentNameError,
+    DuplicateFolderNameError,
+    FolderDepthError,
+    InvalidMoveError,
+    QuotaExceededError,
+)
+from ..extraction import extract_text
+from ..indexing import process_search_index
+from ..models import (
+    Document,
+    DocumentSharedUser,
+    Folder,
+    FolderSharedUser,
+    PendingIndexUpdate,
+    UserStorage,
+)
 
 
 class BaseTest(PlusTestCase):
@@ -44,3 +75,542 @@ class DocumentTestCase(BaseTest):
         Document.objects.create(name="Foo", folder=bar, author=self.user, file=simple_file, modified_by=self.user)
         with self.assertRaises(DuplicateDocumentNameError):
             Document.objects.create(name="Bar", folder=foo, author=self.user, file=simple_file, modified_by=self.user)
+
+
+class FolderMembersTestCase(BaseTest):
+
+    def setUp(self):
+        super().setUp()
+        self.root = Folder.objects.create(name="Root", author=self.user, modified_by=self.user)
+        self.beta = Folder.objects.create(name="Beta", parent=self.root, author=self.user, modified_by=self.user)
+        self.alpha = Folder.objects.create(name="Alpha", parent=self.root, author=self.user, modified_by=self.user)
+        self.gamma = Folder.objects.create(name="Gamma", parent=self.alpha, author=self.user, modified_by=self.user)
+        self.doc_root = self.make_document("Zed", self.root)
+        self.doc_beta = self.make_document("Bee", self.beta)
+        self.doc_gamma = self.make_document("Gee", self.gamma)
+
+    def make_document(self, name, folder):
+        simple_file = SimpleUploadedFile(f"{name}.txt", b"something tasty")
+        return Document.objects.create(name=name, folder=folder, author=self.user, file=simple_file, modified_by=self.user)
+
+    def test_recursive_members_order(self):
+        self.assertEqual(
+            self.root.members(direct=False),
+            [self.alpha, self.beta, self.doc_root, self.doc_beta, self.gamma, self.doc_gamma]
+        )
+
+    def test_recursive_members_query_count(self):
+        for i in range(5):
+            Folder.objects.create(name=f"Extra {i}", parent=self.gamma, author=self.user, modified_by=self.user)
+        with self.assertNumQueries(2):
+            members = self.root.members(direct=False)
+        self.assertEqual(len(members), 11)
+
+    def test_recursive_members_for_user(self):
+        other = self.make_user("other")
+        self.root.share([other])
+        private = Folder.objects.create(name="Private", parent=self.root, author=self.user, modified_by=self.user)
+        self.assertIn(private, self.root.members(direct=False))
+        self.assertNotIn(private, self.root.members(direct=False, user=other))
+        self.assertIn(self.doc_gamma, self.root.members(direct=False, user=other))
+
+
+class FolderAncestryTestCase(BaseTest):
+
+    def setUp(self):
+        super().setUp()
+        self.a = Folder.objects.create(name="A", author=self.user, modified_by=self.user)
+        self.b = Folder.objects.create(name="B", parent=self.a, author=self.user, modified_by=self.user)
+        self.c = Folder.objects.create(name="C", parent=self.b, author=self.user, modified_by=self.user)
+
+    def test_path_maintained_on_create(self):
+        self.assertEqual(self.c.path, f"{self.a.pk}/{self.b.pk}/{self.c.pk}/")
+        self.assertEqual(Folder.objects.get(pk=self.c.pk).path, self.c.path)
+
+    def test_path_maintained_on_move(self):
+        d = Folder.objects.create(name="D", author=self.user, modified_by=self.user)
+        self.b.parent = d
+        self.b.save()
+        self.c.refresh_from_db()
+        self.assertEqual(self.c.path, f"{d.pk}/{self.b.pk}/{self.c.pk}/")
+        self.assertTrue(self.c.is_descendant_of(d))
+        self.assertFalse(self.c.is_descendant_of(self.a))
+
+    def test_breadcrumbs_single_query(self):
+        c = Folder.objects.get(pk=self.c.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(c.breadcrumbs(), [self.a, self.b])
+
+    def test_shared_parent(self):
+        other = self.make_user("other")
+        self.a.share([other])
+        c = Folder.objects.get(pk=self.c.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(c.shared_parent(), self.a)
+
+    def test_in_subtree(self):
+        self.assertEqual(set(Folder.objects.in_subtree(self.a)), {self.b, self.c})
+        simple_file = SimpleUploadedFile("delicious.txt", b"something tasty")
+        document = Document.objects.create(name="Doc", folder=self.c, author=self.user, file=simple_file)
+        self.assertEqual(list(Document.objects.in_subtree(self.b)), [document])
+        self.assertEqual(document.breadcrumbs(), [self.a, self.b, self.c])
+
+    def test_subtree_lookup_matches_whole_ids(self):
+        Folder.objects.filter(pk=self.c.pk).update(path=f"{self.a.pk}0/")
+        self.assertEqual(set(Folder.objects.filter(path__subtree=self.a.path)), {self.a, self.b})
+        self.assertEqual(Folder.objects.exclude(path__subtree=self.a.path).get(), self.c)
+
+    def test_path_length_checked(self):
+        deep = Folder.objects.create(name="Deep", author=self.user, modified_by=self.user)
+        # room for the moved folder's path, but not for its child's
+        prefix = "9" * (254 - len(f"{deep.pk}/") - len(f"{self.b.pk}/")) + "/"
+        deep.path = f"{prefix}{deep.pk}/"
+        Folder.objects.filter(pk=deep.pk).update(path=deep.path)
+        with self.assertRaises(FolderDepthError):
+            self.b.move_to(deep, self.user)
+        self.assertEqual(Folder.objects.get(pk=self.c.pk).path, f"{self.a.pk}/{self.b.pk}/{self.c.pk}/")
+        deep.path = "9" * (254 - len(f"{deep.pk}/")) + f"/{deep.pk}/"
+        Folder.objects.filter(pk=deep.pk).update(path=deep.path)
+        with self.assertRaises(FolderDepthError):
+            Folder.objects.create(name="Child", parent=deep, author=self.user, modified_by=self.user)
+        self.assertFalse(Folder.objects.filter(name="Child").exists())
+
+    def test_touch_single_update(self):
+        other = self.make_user("other")
+        c = Folder.objects.get(pk=self.c.pk)
+        with self.assertNumQueries(1):
+            c.touch(other)
+        self.assertEqual(Folder.objects.filter(modified_by=other).count(), 3)
+        simple_file = SimpleUploadedFile("delicious.txt", b"something tasty")
+        document = Document.objects.create(name="Doc", folder=c, author=self.user, file=simple_file)
+        with self.assertNumQueries(2):
+            document.touch(self.user)
+        self.assertFalse(Folder.objects.filter(modified_by=other).exists())
+
+    @override_settings(DOCUMENTS_TOUCH_INTERVAL=60)
+    def test_touch_coalesced(self):
+        other = self.make_user("other")
+        Folder.objects.filter(pk=self.a.pk).update(modified=timezone.now() - timedelta(minutes=5))
+        self.c.touch(other)
+        self.assertEqual(list(Folder.objects.filter(modified_by=other)), [self.a])
+
+    def test_rebuild_folder_paths(self):
+        Folder.objects.update(path="")
+        call_command("rebuild_folder_paths", stdout=StringIO())
+        self.c.refresh_from_db()
+        self.assertEqual(self.c.path, f"{self.a.pk}/{self.b.pk}/{self.c.pk}/")
+
+
+class FolderShareTestCase(BaseTest):
+
+    def setUp(self):
+        super().setUp()
+        self.root = Folder.objects.create(name="Root", author=self.user, modified_by=self.user)
+        child = Folder.objects.create(name="Child", parent=self.root, author=self.user, modified_by=self.user)
+        for i in range(3):
+            simple_file = SimpleUploadedFile(f"{i}.txt", b"something tasty")
+            Document.objects.create(name=f"{i}", folder=child, author=self.user, file=simple_file, modified_by=self.user)
+        self.others = [self.make_user(f"other{i}") for i in range(3)]
+
+    @override_settings(DOCUMENTS_SHARE_BATCH_SIZE=2)
+    def test_share_streams_batches(self):
+        self.assertEqual(self.root.share(self.others), 15)
+        self.assertEqual(FolderSharedUser.objects.count(), 6)
+        self.assertEqual(DocumentSharedUser.objects.count(), 9)
+
+    def test_share_skips_existing_grants(self):
+        self.root.share(self.others[:1])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.root.share(self.others), 10)
+        self.assertFalse([q for q in queries if "COUNT(" in q["sql"]])
+        self.assertEqual(self.root.share(self.others), 0)
+        self.assertEqual(FolderSharedUser.objects.count(), 6)
+        self.assertEqual(DocumentSharedUser.objects.count(), 9)
+
+    def test_share_skips_author(self):
+        self.assertEqual(self.root.share([self.user]), 0)
+        self.assertFalse(self.root.shared)
+
+
+class MoveRenameTestCase(BaseTest):
+
+    def setUp(self):
+        super().setUp()
+        self.other = self.make_user("other")
+        self.shared = Folder.objects.create(name="Shared", author=self.user, modified_by=self.user)
+        self.private = Folder.objects.create(name="Private", author=self.user, modified_by=self.user)
+        self.child = Folder.objects.create(name="Child", parent=self.private, author=self.user, modified_by=self.user)
+        simple_file = SimpleUploadedFile("delicious.txt", b"something tasty")
+        self.document = Document.objects.create(name="Doc", folder=self.child, author=self.user, file=simple_file)
+        self.child.update_totals(bytes=15, documents=1)
+        self.private.update_totals(folders=1)
+        self.shared.share([self.other])
+
+    def test_move_folder(self):
+        file_name = self.document.file.name
+        self.child.move_to(self.shared, self.other)
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.file.name, file_name)
+        self.assertEqual(Folder.objects.get(pk=self.child.pk).path, f"{self.shared.pk}/{self.child.pk}/")
+        totals = dict(Folder.objects.values_list("name", "total_bytes"))
+        self.assertEqual(totals, {"Shared": 15, "Private": 0, "Child": 15})
+        self.assertEqual(Folder.objects.get(pk=self.shared.pk).folder_count, 1)
+        self.assertIn(self.document, Document.objects.for_user(self.other))
+
+        self.child.move_to(None, self.user)
+        self.assertEqual(Folder.objects.get(pk=self.shared.pk).total_bytes, 0)
+        self.assertFalse(Folder.objects.for_user(self.other).filter(pk=self.child.pk).exists())
+        self.assertFalse(DocumentSharedUser.objects.exists())
+
+    def test_move_folder_into_itself(self):
+        grandchild = Folder.objects.create(name="Grandchild", parent=self.child, author=self.user, modified_by=self.user)
+        for dest in [self.child, grandchild]:
+            with self.assertRaises(InvalidMoveError):
+                self.child.move_to(dest, self.user)
+
+    def test_move_checks_duplicate_names(self):
+        Folder.objects.create(name="Child", parent=self.shared, author=self.user, modified_by=self.user)
+        Document.objects.create(name="Doc", folder=self.shared, author=self.user, file=SimpleUploadedFile("a.txt", b"a"))
+        with self.assertRaises(DuplicateFolderNameError):
+            self.child.move_to(self.shared, self.user)
+        with self.assertNumQueries(1), self.assertRaises(DuplicateDocumentNameError):
+            self.document.move_to(self.shared, self.user)
+
+    def test_move_document(self):
+        self.document.move_to(self.shared, self.user)
+        totals = dict(Folder.objects.values_list("name", "total_bytes"))
+        self.assertEqual(totals, {"Shared": 15, "Private": 0, "Child": 0})
+        self.assertTrue(self.document.shared_with(user=self.other))
+        self.document.move_to(self.child, self.user)
+        self.assertFalse(DocumentSharedUser.objects.exists())
+
+    @override_settings(DOCUMENTS_INHERITED_SHARING=True)
+    def test_move_with_inherited_sharing(self):
+        self.child.move_to(self.shared, self.user)
+        self.assertIn(self.document, Document.objects.for_user(self.other))
+        self.assertEqual(FolderSharedUser.objects.count(), 1)
+
+    def test_rename(self):
+        # the rename is queued for reindexing
+        with self.assertNumQueries(4):
+            self.document.rename("Renamed", self.user)
+        self.assertEqual(Document.objects.get(pk=self.document.pk).name, "Renamed")
+        with self.assertRaises(DuplicateFolderNameError):
+            self.private.rename("Shared", self.user)
+        self.private.rename("Personal", self.user)
+        self.assertEqual(Folder.objects.get(pk=self.private.pk).name, "Personal")
+
+
+class FolderCopyTestCase(BaseTest):
+
+    def setUp(self):
+        super().setUp()
+        self.other = self.make_user("other")
+        self.root = Folder.objects.create(name="Root", author=self.user, modified_by=self.user)
+        self.child = Folder.objects.create(name="Child", parent=self.root, author=self.user, modified_by=self.user)
+        for i, folder in enumerate([self.root, self.child, self.child]):
+            simple_file = SimpleUploadedFile(f"{i}.txt", b"x" * (i + 1))
+            Document.objects.create(name=f"{i}", folder=folder, author=self.user, file=simple_file)
+        call_command("reconcile_folder_totals", stdout=StringIO())
+        self.project = Folder.objects.create(name="Project", author=self.user, modified_by=self.user)
+        self.project.share([self.other])
+
+    def test_copy_shares_stored_files(self):
+        # three queries per folder level, independent of the number of documents
+        with self.assertNumQueries(27):
+            copy = self.root.copy_to(self.project, self.user)
+        self.assertEqual(copy.path, f"{self.project.pk}/{copy.pk}/")
+        child = Folder.objects.get(parent=copy)
+        self.assertEqual(child.path, f"{copy.path}{child.pk}/")
+        originals = set(Document.objects.in_subtree(self.root).values_list("name", "file", "folder__name"))
+        copies = set(Document.objects.in_subtree(copy).values_list("name", "file", "folder__name"))
+        self.assertEqual(originals, copies)
+        self.assertEqual(Document.objects.in_subtree(copy).filter(author=self.user).count(), 3)
+        self.assertEqual(UserStorage.objects.get(user=self.user).bytes_used, 6)
+
+        totals = Folder.objects.values_list("name", "total_bytes", "document_count", "folder_count")
+        self.assertEqual(
+            set(totals.filter(path__subtree=self.project.path)),
+            {("Project", 6, 3, 2), ("Root", 6, 3, 1), ("Child", 5, 2, 0)},
+        )
+        self.assertEqual(Folder.objects.for_user(self.other).filter(path__subtree=copy.path).count(), 2)
+        self.assertEqual(Document.objects.for_user(self.other).count(), 3)
+
+        document = Document.objects.in_subtree(copy).get(name="0")
+        document.delete()
+        self.assertTrue(document.file.storage.exists(document.file.name))
+
+    def test_copy_by_share_recipient(self):
+        self.root.share([self.other])
+        Folder.objects.create(name="Private", parent=self.root, author=self.user, modified_by=self.user)
+        self.child.unshare([self.other])
+        mine = Folder.objects.create(name="Mine", author=self.other, modified_by=self.other)
+        copy = self.root.copy_to(mine, self.other)
+        self.assertEqual(list(Folder.objects.filter(path__subtree=copy.path).values_list("name", flat=True)), ["Root"])
+        self.assertEqual(list(Document.objects.in_subtree(copy).values_list("name", flat=True)), ["0"])
+        self.assertEqual((copy.total_bytes, copy.document_count, copy.folder_count), (1, 1, 0))
+        self.assertEqual(UserStorage.objects.get(user=self.other).bytes_used, 1)
+
+    def test_copy_checks_name_and_quota(self):
+        with self.assertRaises(DuplicateFolderNameError):
+            self.child.copy_to(self.root, self.user)
+        UserStorage.objects.filter(user=self.user).update(bytes_used=F("bytes_total") - 5)
+        with self.assertRaises(QuotaExceededError):
+            self.root.copy_to(self.project, self.user)
+        self.assertFalse(Folder.objects.filter(parent=self.project).exists())
+
+    def test_copy_into_own_subtree(self):
+        copy = self.root.copy_to(self.child, self.user)
+        self.assertEqual(Document.objects.in_subtree(copy).count(), 3)
+        self.assertEqual(Folder.objects.get(pk=self.root.pk).total_bytes, 12)
+
+
+@override_settings(DOCUMENTS_INHERITED_SHARING=True)
+class InheritedSharingTestCase(BaseTest):
+
+    def setUp(self):
+        super().setUp()
+        self.other = self.make_user("other")
+        self.root = Folder.objects.create(name="Root", author=self.user, modified_by=self.user)
+        self.child = Folder.objects.create(name="Child", parent=self.root, author=self.user, modified_by=self.user)
+        simple_file = SimpleUploadedFile("delicious.txt", b"something tasty")
+        self.document = Document.objects.create(name="Doc", folder=self.child, author=self.user, file=simple_file)
+
+    def test_only_root_holds_grant(self):
+        self.assertEqual(self.root.share([self.other]), 1)
+        self.assertFalse(DocumentSharedUser.objects.exists())
+        self.assertEqual(list(Folder.objects.for_user(self.other)), [self.root, self.child])
+        self.assertEqual([d._shared for d in Document.objects.for_user(self.other)], [True])
+        self.assertTrue(self.document.shared_with(user=self.other))
+        self.assertEqual(list(self.document.shared_with()), [self.other])
+        self.assertEqual(self.child.shared_parent(), self.root)
+
+    def test_new_items_inherit_access(self):
+        self.root.share([self.other])
+        grandchild = Folder.objects.create(name="Grandchild", parent=self.child, author=self.user, modified_by=self.user)
+        self.assertIn(grandchild, Folder.objects.for_user(self.other))
+        self.assertEqual(FolderSharedUser.objects.count(), 1)
+        unrelated = Folder.objects.create(name="Unrelated", author=self.user, modified_by=self.user)
+        self.assertNotIn(unrelated, Folder.objects.for_user(self.other))
+
+    def test_collapse_shares(self):
+        with override_settings(DOCUMENTS_INHERITED_SHARING=False):
+            self.root.share([self.other])
+            self.document.share([self.user])
+        self.assertEqual((FolderSharedUser.objects.count(), DocumentSharedUser.objects.count()), (2, 2))
+        call_command("collapse_shares", stdout=StringIO())
+        self.assertEqual(list(FolderSharedUser.objects.values_list("folder", "user")), [(self.root.pk, self.other.pk)])
+        self.assertEqual(list(DocumentSharedUser.objects.values_list("document", "user")), [(self.document.pk, self.user.pk)])
+        self.assertEqual(Document.objects.for_user(self.other).get(), self.document)
+
+
+class ForUserTestCase(BaseTest):
+
+    def test_shared_flag_annotated(self):
+        other = self.make_user("other")
+        mine = Folder.objects.create(name="Mine", author=other, modified_by=other)
+        shared = Folder.objects.create(name="Shared", author=self.user, modified_by=self.user)
+        shared.share([other])
+        with self.assertNumQueries(1):
+            flags = {f.name: f._shared for f in Folder.objects.for_user(other).iterator(chunk_size=1)}
+        self.assertEqual(flags, {mine.name: False, shared.name: True})
+
+
+@override_settings(DOCUMENTS_SHARE_CACHE=True)
+class ShareCacheTestCase(BaseTest):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.other = self.make_user("other")
+        self.folder = Folder.objects.create(name="Shared", author=self.user, modified_by=self.user)
+        self.folder.share([self.other])
+
+    def test_cached_after_first_lookup(self):
+        self.assertTrue(self.folder.shared_with(user=self.other))
+        with self.assertNumQueries(0):
+            self.assertTrue(self.folder.shared_with(user=self.other))
+        self.assertFalse(self.folder.shared_with(user=self.user))
+        self.assertEqual(sharecache.unpack(cache.get(sharecache.cache_key(Folder, self.other.pk))).tolist(), [self.folder.pk])
+        self.assertEqual(sharecache.stats(), {"hits": 1, "misses": 2})
+
+    def test_querysets_use_subquery(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual([f._shared for f in Folder.objects.for_user(self.other)], [True])
+        self.assertIn("documents_foldershareduser", queries[0]["sql"])
+        self.assertEqual(sharecache.stats(), {"hits": 0, "misses": 0})
+
+
+@override_settings(DOCUMENTS_SHARE_CACHE=True)
+class ShareCacheInvalidationTestCase(TransactionTestCase):
+    """
+    Entries are dropped once the transaction commits, so these tests need
+    real transactions.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user("eldarion")
+        self.other = get_user_model().objects.create_user("other")
+        self.folder = Folder.objects.create(name="Shared", author=self.user, modified_by=self.user)
+        self.key = sharecache.cache_key(Folder, self.other.pk)
+
+    def test_invalidated_after_commit(self):
+        self.assertFalse(self.folder.shared_with(user=self.other))
+        with transaction.atomic():
+            self.folder.share([self.other])
+            self.assertIsNotNone(cache.get(self.key))
+        self.assertTrue(self.folder.shared_with(user=self.other))
+        with transaction.atomic():
+            self.folder.unshare([self.other])
+            # a lookup made before the commit caches its view of the shares
+            sharecache.shared_ids(Folder, self.other)
+        self.assertIsNone(cache.get(self.key))
+        self.assertFalse(self.folder.shared_with(user=self.other))
+
+    def test_invalidated_on_delete(self):
+        child = Folder.objects.create(name="Child", parent=self.folder, author=self.user, modified_by=self.user)
+        document = Document.objects.create(
+            name="Doc", folder=child, author=self.user, file=SimpleUploadedFile("delicious.txt", b"something tasty")
+        )
+        self.folder.share([self.other])
+        self.assertTrue(document.shared_with(user=self.other))
+        child.delete()
+        self.assertIsNone(cache.get(sharecache.cache_key(Document, self.other.pk)))
+
+
+class FolderPageTestCase(BaseTest):
+
+    def setUp(self):
+        super().setUp()
+        self.root = Folder.objects.create(name="Root", author=self.user, modified_by=self.user)
+        self.folders = [
+            Folder.objects.create(name=name, parent=self.root, author=self.user, modified_by=self.user)
+            for name in ["b", "a", "c"]
+        ]
+        self.documents = []
+        for name in ["z", "a", "m"]:
+            simple_file = SimpleUploadedFile(f"{name}.txt", b"something tasty")
+            self.documents.append(Document.objects.create(
+                name=name, folder=self.root, author=self.user, file=simple_file, modified_by=self.user
+            ))
+
+    def test_pages_in_kind_name_order(self):
+        pages, cursor = [], None
+        while True:
+            # at most one query per kind
+            with self.assertNumQueriesLessThan(3):
+                members, cursor = Folder.objects.page(self.root, user=self.user, cursor=cursor, limit=2)
+            pages.append([(m.kind, m.name) for m in members])
+            if cursor is None:
+                break
+        self.assertEqual(pages, [
+            [("folder", "a"), ("folder", "b")],
+            [("folder", "c"), ("document", "a")],
+            [("document", "m"), ("document", "z")],
+        ])
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(ValueError):
+            Folder.objects.page(self.root, cursor="garbage")
+
+
+class SearchTestCase(BaseTest):
+
+    def setUp(self):
+        super().setUp()
+        self.other = self.make_user("other")
+        self.folder = Folder.objects.create(name="Reports", author=self.user)
+        self.report = self.create_document("Quarterly report.txt", b"revenue grew in the northern region")
+        self.notes = self.create_document("Notes.txt", b"the quarterly numbers are in the report")
+        self.private = self.create_document("Secret.txt", b"quarterly revenue", author=self.other, folder=None)
+
+    def create_document(self, name, content, author=None, folder=False):
+        return Document.objects.create(
+            name=name,
+            folder=self.folder if folder is False else folder,
+            author=author or self.user,
+            file=SimpleUploadedFile(name, content),
+        )
+
+    def test_documents_indexed_by_worker(self):
+        self.assertEqual(PendingIndexUpdate.objects.count(), 3)
+        self.assertEqual(process_search_index(), (3, 0))
+        self.assertFalse(PendingIndexUpdate.objects.exists())
+        results = Document.objects.for_user(self.user).search("revenue")
+        self.assertEqual(list(results), [self.report])
+        # names rank above contents; terms match as prefixes
+        results = Document.objects.for_user(self.user).search("quarter")
+        self.assertEqual(list(results), [self.report, self.notes])
+        self.assertEqual(list(Document.objects.search("quarterly revenue")), [self.report, self.private])
+        self.assertFalse(Document.objects.search('"*:)').exists())
+
+    def test_rename_and_delete_update_index(self):
+        process_search_index()
+        self.report.rename("Annual summary", self.user)
+        process_search_index()
+        self.assertEqual(list(Document.objects.search("annual")), [self.report])
+        delete_documents(Document.objects.filter(pk=self.report.pk))
+        self.notes.delete()
+        self.assertFalse(Document.objects.search("revenue annual").exists())
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM documents_search")
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_failed_extraction_retried(self):
+        with mock.patch("pinax.documents.hooks.DocumentsDefaultHookSet.extract_text", side_effect=ValueError("corrupt")):
+            self.assertEqual(process_search_index(limit=1), (0, 1))
+        entry = PendingIndexUpdate.objects.get(attempts=1)
+        self.assertEqual(entry.last_error, "corrupt")
+        self.assertGreater(entry.next_attempt, timezone.now())
+        self.assertEqual(process_search_index(), (2, 0))
+
+    def test_office_documents(self):
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, "w") as f:
+            f.writestr("word/document.xml", "<document><body><p><r><t>Budget forecast</t></r></p></body></document>")
+            f.writestr("word/styles.xml", "<styles><name>Heading</name></styles>")
+        document = self.create_document("Plan.docx", archive.getvalue())
+        archive.seek(0)
+        self.assertEqual(extract_text(document, archive), "Budget forecast")
+        process_search_index()
+        self.assertEqual(list(Document.objects.search("forecast")), [document])
+        self.assertFalse(Document.objects.search("heading").exists())
+
+
+class QuotaReservationStressTestCase(TransactionTestCase):
+    """
+    Races many threads, each on its own connection, for the same quota.
+    Needs a database the threads can share; Django's in-memory SQLite test
+    database is one, since it opens in shared-cache mode.
+    """
+
+    threads = 20
+
+    def setUp(self):
+        name = connection.settings_dict["NAME"]
+        if connection.vendor == "sqlite" and connection.is_in_memory_db() and "cache=shared" not in name:
+            self.skipTest("each thread would get its own in-memory database")
+
+    def test_concurrent_reservations_never_exceed_quota(self):
+        user = get_user_model().objects.create_user("eldarion")
+        storage = UserStorage.objects.get(user=user)
+        UserStorage.objects.filter(pk=storage.pk).update(bytes_total=50)
+        barrier = threading.Barrier(self.threads)
+        results = []
+
+        def upload():
+            try:
+                barrier.wait()
+                results.append(storage.reserve(10))
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=upload) for _ in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(len(results), self.threads)
+        self.assertEqual(results.count(True), 5)
+        self.assertEqual(UserStorage.objects.get(pk=storage.pk).bytes_used, 50)
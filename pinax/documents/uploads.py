@@ -0,0 +1,80 @@
+import hashlib
+import io
+
+
+class ChunkReader(io.RawIOBase):
+    """
+    Reads a sequence of stored chunks as one file, opening one chunk at a
+    time so memory use stays bounded by the read size.
+    """
+
+    def __init__(self, storage, names):
+        self.storage = storage
+        self.names = names
+        self._index = 0
+        self._current = None
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        parts = []
+        while size != 0:
+            if self._current is None:
+                if self._index >= len(self.names):
+                    break
+                self._current = self.storage.open(self.names[self._index], "rb")
+                self._index += 1
+            data = self._current.read(size)
+            if not data:
+                self._current.close()
+                self._current = None
+                continue
+            parts.append(data)
+            self._position += len(data)
+            if size > 0:
+                size -= len(data)
+        return b"".join(parts)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if offset != 0 or whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("ChunkReader can only rewind")
+        if self._current is not None:
+            self._current.close()
+        self._index, self._current, self._position = 0, None, 0
+        return 0
+
+    def seekable(self):
+        return False
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        if self._current is not None:
+            self._current.close()
+            self._current = None
+        super().close()
+
+
+class HashingReader(io.RawIOBase):
+    """
+    Passes reads through to `f` while computing the SHA-256 digest of
+    everything read, so a file can be stored and checksummed in one pass.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.digest = hashlib.sha256()
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.digest.update(data)
+        return data
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
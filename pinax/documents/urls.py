@@ -9,18 +9,46 @@ urlpatterns = [
         name="document_index"),
     url(r"^d/create/$", views.DocumentCreate.as_view(),
         name="document_create"),
+    url(r"^d/search/$", views.DocumentSearch.as_view(),
+        name="document_search"),
+    url(r"^d/batch/$", views.DocumentBatchCreate.as_view(),
+        name="document_batch_create"),
+    url(r"^d/upload/$", views.DocumentUploadCreate.as_view(),
+        name="document_upload_create"),
+    url(r"^d/upload/(?P<pk>[0-9a-f-]+)/$", views.DocumentUploadDetail.as_view(),
+        name="document_upload_detail"),
+    url(r"^d/upload/(?P<pk>[0-9a-f-]+)/commit/$", views.DocumentUploadCommit.as_view(),
+        name="document_upload_commit"),
     url(r"^d/(?P<pk>\d+)/$", views.DocumentDetail.as_view(),
         name="document_detail"),
     url(r"^d/(?P<pk>\d+)/download/$", views.DocumentDownload.as_view(),
         name="document_download"),
     url(r"^d/(?P<pk>\d+)/delete/$", views.DocumentDelete.as_view(),
         name="document_delete"),
+    url(r"^d/(?P<pk>\d+)/restore/$", views.DocumentRestore.as_view(),
+        name="document_restore"),
+    url(r"^d/(?P<pk>\d+)/move/$", views.DocumentMove.as_view(),
+        name="document_move"),
+    url(r"^d/(?P<pk>\d+)/rename/$", views.DocumentRename.as_view(),
+        name="document_rename"),
     url(r"^f/create/$", views.FolderCreate.as_view(),
         name="folder_create"),
     url(r"^f/(?P<pk>\d+)/$", views.FolderDetail.as_view(),
         name="folder_detail"),
+    url(r"^f/(?P<pk>\d+)/download/$", views.FolderDownload.as_view(),
+        name="folder_download"),
     url(r"^f/(?P<pk>\d+)/share/$", views.FolderShare.as_view(),
         name="folder_share"),
+    url(r"^f/(?P<pk>\d+)/unshare/$", views.FolderUnshare.as_view(),
+        name="folder_unshare"),
     url(r"^f/(?P<pk>\d+)/delete/$", views.FolderDelete.as_view(),
         name="folder_delete"),
+    url(r"^f/(?P<pk>\d+)/restore/$", views.FolderRestore.as_view(),
+        name="folder_restore"),
+    url(r"^f/(?P<pk>\d+)/move/$", views.FolderMove.as_view(),
+        name="folder_move"),
+    url(r"^f/(?P<pk>\d+)/copy/$", views.FolderCopy.as_view(),
+        name="folder_copy"),
+    url(r"^f/(?P<pk>\d+)/rename/$", views.FolderRename.as_view(),
+        name="folder_rename"),
 ]
@@ -1,4 +1,26 @@
+import base64
+import hashlib
+import json
 import math
+import mimetypes
+
+import django
+from django.db.models import Count, Exists, OuterRef, Q, Sum
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce, Length, Substr
+
+
+class SubquerySQL(RawSQL):
+    """
+    Raw SQL for a complete SELECT, used on the right of `__in`. Django 2.2
+    parenthesizes such expressions itself, and SQLite reads the doubled
+    `IN ((SELECT ...))` as a single value, so the SQL is left bare there.
+    """
+
+    def as_sql(self, compiler, connection):
+        if django.VERSION < (3, 0):
+            return self.sql, self.params
+        return super().as_sql(compiler, connection)
 
 
 def convert_bytes(bytes):
@@ -14,3 +36,151 @@ def convert_bytes(bytes):
     else:
         size, srepr = bytes, " bytes"
     return "%d%s" % (math.ceil(size), srepr)
+
+
+def encode_cursor(*key):
+    """
+    Encodes a keyset pagination key as an opaque, URL-safe string.
+    """
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Decodes a cursor made by `encode_cursor`. Raises ValueError if it is malformed.
+    """
+    try:
+        kind, name, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, ValueError, UnicodeError, base64.binascii.Error):
+        raise ValueError(f"Invalid cursor '{cursor}'")
+    if kind not in ("folder", "document") or not isinstance(name, str) or not isinstance(pk, int):
+        raise ValueError(f"Invalid cursor '{cursor}'")
+    return kind, name, pk
+
+
+def file_checksum(f, rewind=True):
+    """
+    Returns the hex SHA-256 digest of `f`, read in chunks. Rewinds `f`
+    afterwards so it can be saved, unless `rewind` is False.
+    """
+    digest = hashlib.sha256()
+    for chunk in f.chunks():
+        digest.update(chunk)
+    if rewind:
+        f.seek(0)
+    return digest.hexdigest()
+
+
+def guess_content_type(name):
+    return mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+
+def build_folder_paths(model, using="default", batch_size=500):
+    """
+    Recomputes the materialized `path` of every folder of `model` from its
+    `parent` chain and writes back the ones that are out of date. Returns
+    the number of folders updated.
+    """
+    qs = model._default_manager.using(using)
+    parents, stored = {}, {}
+    for pk, parent_id, path in qs.values_list("pk", "parent_id", "path").iterator():
+        parents[pk], stored[pk] = parent_id, path
+    paths = {}
+
+    def resolve(pk):
+        chain = []
+        while pk is not None and pk not in paths:
+            chain.append(pk)
+            pk = parents[pk]
+        prefix = paths[pk] if pk is not None else ""
+        for pk in reversed(chain):
+            prefix = paths[pk] = f"{prefix}{pk}/"
+        return prefix
+
+    changed = [model(pk=pk, path=resolve(pk)) for pk in parents]
+    changed = [obj for obj in changed if obj.path != stored[obj.pk]]
+    qs.bulk_update(changed, ["path"], batch_size=batch_size)
+    return len(changed)
+
+
+def build_folder_totals(folder_model, document_model, using="default", batch_size=500):
+    """
+    Recomputes the recursive byte total, document count and folder count of
+    every folder and writes back the ones that have drifted. Returns the
+    number of folders updated.
+    """
+    folders = folder_model._default_manager.using(using)
+    documents = document_model._default_manager.using(using)
+    fields = ["total_bytes", "document_count", "folder_count"]
+    stored, ancestors = {}, {}
+    for pk, path, *values in folders.values_list("pk", "path", *fields).iterator():
+        stored[pk] = tuple(values)
+        ancestors[pk] = [int(a) for a in path.split("/") if a]
+    totals = {pk: [0, 0, 0] for pk in stored}
+    for pk, ids in ancestors.items():
+        for ancestor in ids[:-1]:
+            totals[ancestor][2] += 1
+    direct = documents.filter(folder__isnull=False).values_list("folder").annotate(
+        bytes=Coalesce(Sum("file_size"), 0),
+        count=Count("pk"),
+    )
+    for folder_id, bytes, count in direct.order_by().iterator():
+        for ancestor in ancestors[folder_id]:
+            totals[ancestor][0] += bytes
+            totals[ancestor][1] += count
+    changed = [
+        folder_model(pk=pk, **dict(zip(fields, values)))
+        for pk, values in totals.items()
+        if tuple(values) != stored[pk]
+    ]
+    folders.bulk_update(changed, fields, batch_size=batch_size)
+    return len(changed)
+
+
+def collapse_shares(folder_shared_model, document_shared_model, using="default", batch_size=500):
+    """
+    Deletes share rows made redundant by inherited sharing: folder and
+    document grants for a user who already holds a grant on an ancestor
+    folder. Returns the number of rows deleted.
+    """
+    folder_grants = folder_shared_model._default_manager.using(using)
+    deleted = 0
+    for model, path, self_filter in [
+        (folder_shared_model, "folder__path", ~Q(folder=OuterRef("folder"))),
+        (document_shared_model, "document__folder__path", Q()),
+    ]:
+        covering = folder_grants.filter(
+            self_filter,
+            user=OuterRef("user"),
+            folder__path=Substr(OuterRef(path), 1, Length("folder__path")),
+        )
+        redundant = model._default_manager.using(using).annotate(covered=Exists(covering)).filter(covered=True)
+        while True:
+            pks = list(redundant.values_list("pk", flat=True)[:batch_size])
+            if not pks:
+                break
+            deleted += model._default_manager.using(using).filter(pk__in=pks).delete()[0]
+    return deleted
+
+
+def backfill_document_metadata(model, using="default", batch_size=500):
+    """
+    Populates `file_size`, `content_type` and `checksum` of documents that
+    predate them, streaming rows and file contents in batches. Documents
+    whose file cannot be read are left untouched.
+    """
+    qs = model._default_manager.using(using).filter(file_size__isnull=True)
+    batch = []
+    for document in qs.only("pk", "file", "original_filename").iterator(chunk_size=batch_size):
+        try:
+            with document.file.open("rb") as f:
+                document.checksum = file_checksum(f)
+            document.file_size = document.file.size
+        except (OSError, ValueError):
+            continue
+        document.content_type = guess_content_type(document.original_filename or document.file.name)
+        batch.append(document)
+        if len(batch) >= batch_size:
+            model._default_manager.using(using).bulk_update(batch, ["file_size", "content_type", "checksum"])
+            batch = []
+    model._default_manager.using(using).bulk_update(batch, ["file_size", "content_type", "checksum"])
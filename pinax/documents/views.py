@@ -1,15 +1,20 @@
 from django.db import transaction
-from django.db.models import F
-from django.http import Http404, HttpResponse, HttpResponseRedirect
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseRedirect,
+    JsonResponse,
+)
 from django.shortcuts import get_object_or_404
 from django.urls import reverse, reverse_lazy
 from django.utils.translation import gettext as _
-from django.views import static
 from django.views.generic import (
     CreateView,
     DeleteView,
     DetailView,
     TemplateView,
+    View,
 )
 from django.views.generic.detail import (
     SingleObjectMixin,
@@ -17,26 +22,81 @@ from django.views.generic.detail import (
 )
 from django.views.generic.edit import FormMixin, ProcessFormView
 
+from . import batch, downloads
 from .compat import LoginRequiredMixin
 from .conf import settings
+from .exceptions import (
+    BatchUploadError,
+    DuplicateDocumentNameError,
+    DuplicateFolderNameError,
+    FolderDepthError,
+    InvalidMoveError,
+    QuotaExceededError,
+    TrashedParentError,
+)
 from .forms import (
     ColleagueFolderShareForm,
+    DocumentBatchForm,
     DocumentCreateForm,
     DocumentCreateFormWithName,
+    DocumentRenameForm,
+    DocumentUploadCommitForm,
+    DocumentUploadForm,
     FolderCreateForm,
+    FolderRenameForm,
+    FolderUnshareForm,
+    MoveForm,
 )
 from .hooks import hookset
-from .models import Document, Folder, UserStorage
+from .models import Document, Folder, UploadSession
+from .utils import file_checksum, guess_content_type
+
+
+class AccessibleObjectMixin:
+    """
+    Looks up the object among those the user can access. With the share
+    cache enabled, it is loaded by pk alone and the share check is answered
+    from the cached ids instead of a subquery.
+    """
+
+    def get_queryset(self):
+        if settings.DOCUMENTS_SHARE_CACHE:
+            qs = self.model.objects.filter(trashed__isnull=True)
+            return qs.select_related("folder") if self.model is Document else qs
+        return self.model.objects.for_user(self.request.user)
 
+    def get_object(self, queryset=None):
+        obj = super().get_object(queryset)
+        user = self.request.user
+        if settings.DOCUMENTS_SHARE_CACHE and obj.author_id != user.pk and not obj.shared_with(user=user):
+            raise Http404(
+                _("No %(verbose_name)s found matching the query") % {"verbose_name": self.model._meta.verbose_name}
+            )
+        return obj
 
-class IndexView(LoginRequiredMixin, TemplateView):
+
+class MemberPageMixin:
+
+    def get_member_page(self, folder):
+        try:
+            members, next_cursor = Folder.objects.page(
+                folder,
+                user=self.request.user,
+                cursor=self.request.GET.get("cursor"),
+            )
+        except ValueError:
+            raise Http404(_("Invalid cursor."))
+        return {"members": members, "next_cursor": next_cursor}
+
+
+class IndexView(LoginRequiredMixin, MemberPageMixin, TemplateView):
 
     template_name = "pinax/documents/index.html"
 
     def get_context_data(self, **kwargs):
         ctx = kwargs
+        ctx.update(self.get_member_page(None))
         ctx.update({
-            "members": Folder.objects.members(None, user=self.request.user),
             "storage": self.request.user.storage,
             "can_share": False,
         })
@@ -73,10 +133,13 @@ class FolderCreate(LoginRequiredMixin, CreateView):
 
     def create_folder(self, **kwargs):
         folder = self.model.objects.create(**kwargs)
-        folder.touch(self.request.user)
-        # if folder is not amongst anything shared it will share with no
-        # users which share will no-op; perhaps not the best way?
-        folder.share(folder.shared_parent().shared_with())
+        if folder.parent is not None:
+            folder.parent.touch(self.request.user)
+            folder.parent.update_totals(folders=1)
+        if not settings.DOCUMENTS_INHERITED_SHARING:
+            # if folder is not amongst anything shared it will share with no
+            # users which share will no-op; perhaps not the best way?
+            folder.share(folder.shared_parent().shared_with())
         return folder
 
     def form_valid(self, form):
@@ -85,30 +148,43 @@ class FolderCreate(LoginRequiredMixin, CreateView):
             "author": self.request.user,
             "parent": form.cleaned_data["parent"],
         }
-        self.object = self.create_folder(**kwargs)
+        try:
+            self.object = self.create_folder(**kwargs)
+        except FolderDepthError as e:
+            form.add_error(None, str(e))
+            return self.form_invalid(form)
         hookset.folder_created_message(self.request, self.object)
         return HttpResponseRedirect(self.get_success_url())
 
 
-class FolderDetail(LoginRequiredMixin, DetailView):
+class FolderDetail(LoginRequiredMixin, AccessibleObjectMixin, MemberPageMixin, DetailView):
     model = Folder
     template_name = "pinax/documents/folder_detail.html"
 
-    def get_queryset(self):
-        qs = super().get_queryset()
-        qs = qs.for_user(self.request.user)
-        return qs
-
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         ctx = {
-            "members": self.object.members(user=self.request.user),
             "can_share": self.object.can_share(self.request.user),
         }
+        ctx.update(self.get_member_page(self.object))
         context.update(ctx)
         return context
 
 
+class FolderDownload(LoginRequiredMixin, DetailView):
+    """
+    Streams a zip archive of a folder and everything below it.
+    """
+    model = Folder
+
+    def get_queryset(self):
+        return super().get_queryset().for_user(self.request.user)
+
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        return downloads.serve_folder(request, self.object)
+
+
 class FolderShare(LoginRequiredMixin,
                   SingleObjectTemplateResponseMixin,
                   FormMixin,
@@ -124,6 +200,9 @@ class FolderShare(LoginRequiredMixin,
         return super().get(request, *args, **kwargs)
 
     def post(self, request, *args, **kwargs):
+        if "remove" in request.POST:
+            # the "Shared with" list posts here with the user to remove
+            return FolderUnshare.as_view()(request, *args, **kwargs)
         self.object = self.get_object()
         return super().post(request, *args, **kwargs)
 
@@ -161,18 +240,156 @@ class FolderShare(LoginRequiredMixin,
         return context
 
 
+class FolderUnshare(FolderShare):
+    """
+    Revokes access to a folder and its whole subtree. Accepts the users to
+    remove as `participants` (or a single `remove`).
+    """
+    form_class = FolderUnshareForm
+    http_method_names = ["post"]
+
+    def post(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        return ProcessFormView.post(self, request, *args, **kwargs)
+
+    def get_form_kwargs(self):
+        kwargs = FormMixin.get_form_kwargs(self)
+        if "remove" in self.request.POST:
+            kwargs["data"] = {"participants": self.request.POST.getlist("remove")}
+        kwargs.update({"participants": self.object.shared_with()})
+        return kwargs
+
+    def form_valid(self, form):
+        users = form.cleaned_data["participants"]
+        self.object.unshare(users)
+        for user in users:
+            hookset.folder_unshared_message(self.request, user, self.object)
+        return HttpResponseRedirect(reverse("pinax_documents:folder_share", args=[self.object.pk]))
+
+    def form_invalid(self, form):
+        return HttpResponseBadRequest(form.errors.as_text())
+
+
 class FolderDelete(LoginRequiredMixin, DeleteView):
     model = Folder
     success_url = reverse_lazy("pinax_documents:document_index")
     template_name = "pinax/documents/folder_confirm_delete.html"
 
     def delete(self, request, *args, **kwargs):
+        if settings.DOCUMENTS_TRASH:
+            self.object = self.get_object()
+            self.object.trash()
+            hookset.folder_deleted_message(self.request, self.object)
+            return HttpResponseRedirect(self.get_success_url())
         hookset.folder_pre_delete(self.request, self.get_object())
         success_url = super().delete(request, *args, **kwargs)
         hookset.folder_deleted_message(self.request, self.object)
         return success_url
 
 
+class RestoreView(LoginRequiredMixin, SingleObjectMixin, View):
+    """
+    Takes an item out of the trash. Only the items the user could see
+    before they were trashed can be restored.
+    """
+
+    http_method_names = ["post"]
+
+    def get_queryset(self):
+        return self.model.objects.for_user(self.request.user, trashed=True)
+
+    def post(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        try:
+            self.object.restore()
+        except (DuplicateDocumentNameError, DuplicateFolderNameError, TrashedParentError) as e:
+            return HttpResponse(str(e), status=409)
+        self.restored_message()
+        return HttpResponseRedirect(self.object.get_absolute_url())
+
+
+class FolderRestore(RestoreView):
+    model = Folder
+
+    def restored_message(self):
+        hookset.folder_restored_message(self.request, self.object)
+
+
+class MemberEditView(LoginRequiredMixin, FormMixin, SingleObjectMixin, ProcessFormView):
+    """
+    Base for the move, rename and copy views. Applies the posted form to an item
+    the user can see and redirects to it; errors are answered with 400.
+    Unless `author_only` is False, only the item's author may change it.
+    """
+
+    http_method_names = ["post"]
+    author_only = True
+
+    def get_queryset(self):
+        qs = self.model.objects.for_user(self.request.user)
+        if self.author_only:
+            qs = qs.filter(author=self.request.user)
+        return qs
+
+    def post(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        return super().post(request, *args, **kwargs)
+
+    def form_valid(self, form):
+        try:
+            self.apply(form.cleaned_data)
+        except (
+            DuplicateDocumentNameError,
+            DuplicateFolderNameError,
+            FolderDepthError,
+            InvalidMoveError,
+            QuotaExceededError,
+        ) as e:
+            return HttpResponseBadRequest(str(e))
+        return HttpResponseRedirect(self.object.get_absolute_url())
+
+    def form_invalid(self, form):
+        return HttpResponseBadRequest(form.errors.as_text())
+
+
+class MoveView(MemberEditView):
+    form_class = MoveForm
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        # the destination must be visible to whoever owns the result: the
+        # author for a move, the user for a copy
+        owner = self.object.author if self.author_only else self.request.user
+        kwargs.update({"folders": Folder.objects.for_user(owner)})
+        return kwargs
+
+
+class FolderMove(MoveView):
+    model = Folder
+
+    def apply(self, data):
+        self.object.move_to(data["folder"], self.request.user)
+        hookset.folder_moved_message(self.request, self.object)
+
+
+class FolderCopy(MoveView):
+    model = Folder
+    author_only = False
+
+    def apply(self, data):
+        self.object = self.object.copy_to(data["folder"], self.request.user)
+        hookset.folder_copied_message(self.request, self.object)
+
+
+class FolderRename(MemberEditView):
+    model = Folder
+    form_class = FolderRenameForm
+
+    def apply(self, data):
+        self.object.rename(data["name"], self.request.user)
+        hookset.folder_renamed_message(self.request, self.object)
+
+
 class DocumentCreate(LoginRequiredMixin, CreateView):
     model = Document
     form_class = DocumentCreateForm
@@ -204,17 +421,20 @@ class DocumentCreate(LoginRequiredMixin, CreateView):
 
     def create_document(self, **kwargs):
         document = self.model.objects.create(**kwargs)
-        document.touch(self.request.user)
         if document.folder is not None:
-            # if folder is not amongst anything shared it will share with no
-            # users which share will no-op; perhaps not the best way?
-            document.share(document.folder.shared_parent().shared_with())
+            document.folder.touch(self.request.user)
+            if not settings.DOCUMENTS_INHERITED_SHARING:
+                # if folder is not amongst anything shared it will share with no
+                # users which share will no-op; perhaps not the best way?
+                document.share(document.folder.shared_parent().shared_with())
         return document
 
-    def increase_usage(self, bytes):
-        # increase usage for this user based on document size
-        storage_qs = UserStorage.objects.filter(pk=self.request.user.storage.pk)
-        storage_qs.update(bytes_used=F("bytes_used") + bytes)
+    def reserve_usage(self, bytes):
+        # atomically claim quota for this user; False when it would be exceeded
+        return self.request.user.storage.reserve(bytes)
+
+    def release_usage(self, bytes):
+        self.request.user.storage.release(bytes)
 
     def get_create_kwargs(self, form):
         return {
@@ -225,14 +445,32 @@ class DocumentCreate(LoginRequiredMixin, CreateView):
             "file": form.cleaned_data["file"],
         }
 
+    def get_file_metadata(self, upload):
+        return {
+            "file_size": upload.size,
+            "content_type": upload.content_type or guess_content_type(upload.name),
+            "checksum": file_checksum(upload),
+        }
+
     def form_valid(self, form):
-        with transaction.atomic():
-            kwargs = self.get_create_kwargs(form)
-            self.object = self.create_document(**kwargs)
-            hookset.document_created_message(self.request, self.object)
-            bytes = form.cleaned_data["file"].size
-            self.increase_usage(bytes)
-            return HttpResponseRedirect(self.get_success_url())
+        bytes = form.cleaned_data["file"].size
+        if not self.reserve_usage(bytes):
+            form.add_error("file", _("File will exceed storage capacity."))
+            return self.form_invalid(form)
+        try:
+            with transaction.atomic():
+                kwargs = self.get_create_kwargs(form)
+                kwargs.update(self.get_file_metadata(form.cleaned_data["file"]))
+                if settings.DOCUMENTS_CONTENT_ADDRESSED_STORAGE:
+                    kwargs["file"] = Document.store_blob(kwargs["file"], kwargs["checksum"])
+                self.object = self.create_document(**kwargs)
+                if self.object.folder is not None:
+                    self.object.folder.update_totals(bytes=bytes, documents=1)
+        except Exception:
+            self.release_usage(bytes)
+            raise
+        hookset.document_created_message(self.request, self.object)
+        return HttpResponseRedirect(self.get_success_url())
 
 
 class DocumentWithCustomNameCreate(DocumentCreate):
@@ -249,44 +487,198 @@ class DocumentWithCustomNameCreate(DocumentCreate):
         }
 
 
-class DocumentDetail(LoginRequiredMixin, DetailView):
-    model = Document
-    template_name = "pinax/documents/document_detail.html"
+def upload_response(session, status=200):
+    response = JsonResponse({
+        "id": str(session.pk),
+        "name": session.name,
+        "offset": session.offset,
+        "size": session.size,
+        "url": session.get_absolute_url(),
+        "commit_url": reverse("pinax_documents:document_upload_commit", args=[session.pk]),
+    }, status=status)
+    response["Location"] = session.get_absolute_url()
+    response["Upload-Offset"] = session.offset
+    response["Upload-Length"] = session.size
+    return response
+
+
+class DocumentBatchCreate(LoginRequiredMixin, FormMixin, ProcessFormView):
+    """
+    Creates many documents at once from uploaded `files` and/or a zip
+    `archive`, whose directories become folders below `folder`.
+    """
+    form_class = DocumentBatchForm
+    http_method_names = ["post"]
 
-    def get_queryset(self):
-        qs = super().get_queryset()
-        qs = qs.for_user(self.request.user)
-        return qs
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs.update({"folders": Folder.objects.for_user(self.request.user)})
+        return kwargs
+
+    def form_valid(self, form):
+        try:
+            entries = batch.upload_entries(form.cleaned_data["files"])
+            if form.cleaned_data["archive"]:
+                entries += batch.archive_entries(form.cleaned_data["archive"])
+            documents = batch.ingest(self.request.user, form.cleaned_data["folder"], entries)
+        except (BatchUploadError, DuplicateDocumentNameError, DuplicateFolderNameError, FolderDepthError) as e:
+            return JsonResponse({"errors": {"__all__": [str(e)]}}, status=400)
+        return JsonResponse({
+            "documents": [
+                {"id": document.pk, "name": document.name, "folder": document.folder_id, "url": document.get_absolute_url()}
+                for document in documents
+            ],
+        }, status=201)
+
+    def form_invalid(self, form):
+        return JsonResponse({"errors": form.errors}, status=400)
+
+
+class DocumentSearch(LoginRequiredMixin, View):
+    """
+    Returns the documents the user can access that match `q`, best matches
+    first, as JSON.
+    """
 
+    def get(self, request, *args, **kwargs):
+        query = request.GET.get("q", "")
+        documents = Document.objects.for_user(request.user).search(query)
+        documents = documents[:settings.DOCUMENTS_PAGE_SIZE]
+        return JsonResponse({
+            "documents": [
+                {"id": document.pk, "name": document.name, "folder": document.folder_id, "url": document.get_absolute_url()}
+                for document in documents
+            ],
+        })
 
-class DocumentDownload(LoginRequiredMixin, DetailView):
-    model = Document
+
+class DocumentUploadCreate(LoginRequiredMixin, CreateView):
+    """
+    Starts a resumable upload and reserves quota for its full size.
+    """
+    model = UploadSession
+    form_class = DocumentUploadForm
+    http_method_names = ["post"]
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs.update({"folders": Folder.objects.for_user(self.request.user),
+                       "storage": self.request.user.storage})
+        return kwargs
+
+    def form_valid(self, form):
+        if not self.request.user.storage.reserve(form.cleaned_data["size"]):
+            form.add_error("size", _("File will exceed storage capacity."))
+            return self.form_invalid(form)
+        form.instance.user = self.request.user
+        self.object = form.save()
+        return upload_response(self.object, status=201)
+
+    def form_invalid(self, form):
+        return JsonResponse({"errors": form.errors}, status=400)
+
+
+class DocumentUploadDetail(LoginRequiredMixin, SingleObjectMixin, View):
+    """
+    Reports (GET/HEAD), appends to (PATCH) or aborts (DELETE) a resumable
+    upload. PATCH requests carry the next chunk as their body and the
+    offset it starts at in an `Upload-Offset` header.
+    """
+    model = UploadSession
 
     def get_queryset(self):
-        qs = super().get_queryset()
-        qs = qs.for_user(self.request.user)
-        return qs
+        return super().get_queryset().filter(user=self.request.user)
 
     def get(self, request, *args, **kwargs):
         self.object = self.get_object()
-        if settings.DOCUMENTS_USE_X_ACCEL_REDIRECT:
-            response = HttpResponse()
-            response["X-Accel-Redirect"] = self.object.file.url
-            # delete content-type to allow Gondor to determine the filetype and
-            # we definitely don't want Django's crappy default :-)
-            del response["content-type"]
-        else:
-            # Note:
-            #
-            # The 'django.views.static.py' docstring states:
-            #
-            #     Views and functions for serving static files. These are only to be used
-            #     during development, and SHOULD NOT be used in a production setting.
-            #
-            response = static.serve(request, self.object.file.name,
-                                    document_root=settings.MEDIA_ROOT)
+        return upload_response(self.object)
+
+    def patch(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        try:
+            offset = int(request.META["HTTP_UPLOAD_OFFSET"])
+            length = int(request.META["CONTENT_LENGTH"])
+        except (KeyError, ValueError):
+            return HttpResponseBadRequest(_("Upload-Offset and Content-Length headers are required."))
+        if length <= 0:
+            return HttpResponseBadRequest(_("Chunks cannot be empty."))
+        if length > settings.DOCUMENTS_UPLOAD_MAX_CHUNK_SIZE:
+            return HttpResponse(status=413)
+        if not self.object.append(request, offset, length):
+            self.object.refresh_from_db()
+            return upload_response(self.object, status=409)
+        return upload_response(self.object)
+
+    def delete(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        self.object.delete()
+        return HttpResponse(status=204)
+
+
+class DocumentUploadCommit(DocumentCreate):
+    """
+    Assembles a completed resumable upload into a Document through the same
+    path as DocumentCreate.
+    """
+    form_class = DocumentUploadCommitForm
+    http_method_names = ["post"]
+
+    def post(self, request, *args, **kwargs):
+        qs = UploadSession.objects.filter(user=request.user)
+        self.session = get_object_or_404(qs, pk=kwargs["pk"])
+        if not self.session.complete:
+            return upload_response(self.session, status=409)
+        return super().post(request, *args, **kwargs)
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs.update({
+            "data": {"folder": self.session.folder_id or ""},
+            "files": {"file": self.session.open()},
+        })
+        return kwargs
+
+    def get_file_metadata(self, upload):
+        if settings.DOCUMENTS_CONTENT_ADDRESSED_STORAGE:
+            # the blob is named after the digest, which is needed first
+            return super().get_file_metadata(upload)
+        name, checksum = self.session.store()
+        return {
+            "file": name,
+            "file_size": upload.size,
+            "content_type": upload.content_type,
+            "checksum": checksum,
+        }
+
+    def reserve_usage(self, bytes):
+        # quota was reserved when the upload session was created
+        return True
+
+    def release_usage(self, bytes):
+        # the reservation stays with the session until it is deleted
+        pass
+
+    def form_valid(self, form):
+        response = super().form_valid(form)
+        self.session.delete(committed=True)
         return response
 
+    def form_invalid(self, form):
+        return JsonResponse({"errors": form.errors}, status=400)
+
+
+class DocumentDetail(LoginRequiredMixin, AccessibleObjectMixin, DetailView):
+    model = Document
+    template_name = "pinax/documents/document_detail.html"
+
+
+class DocumentDownload(LoginRequiredMixin, AccessibleObjectMixin, DetailView):
+    model = Document
+
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        return downloads.get_backend().response(request, self.object)
+
 
 class DocumentDelete(LoginRequiredMixin, DeleteView):
     model = Document
@@ -294,6 +686,35 @@ class DocumentDelete(LoginRequiredMixin, DeleteView):
     template_name = "pinax/documents/document_confirm_delete.html"
 
     def delete(self, request, *args, **kwargs):
+        if settings.DOCUMENTS_TRASH:
+            self.object = self.get_object()
+            self.object.trash()
+            hookset.document_deleted_message(self.request, self.object)
+            return HttpResponseRedirect(self.get_success_url())
         success_url = super().delete(request, *args, **kwargs)
         hookset.document_deleted_message(self.request, self.object)
         return success_url
+
+
+class DocumentRestore(RestoreView):
+    model = Document
+
+    def restored_message(self):
+        hookset.document_restored_message(self.request, self.object)
+
+
+class DocumentMove(MoveView):
+    model = Document
+
+    def apply(self, data):
+        self.object.move_to(data["folder"], self.request.user)
+        hookset.document_moved_message(self.request, self.object)
+
+
+class DocumentRename(MemberEditView):
+    model = Document
+    form_class = DocumentRenameForm
+
+    def apply(self, data):
+        self.object.rename(data["name"], self.request.user)
+        hookset.document_renamed_message(self.request, self.object)